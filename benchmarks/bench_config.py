@@ -0,0 +1,25 @@
+from harness import benchmark
+
+
+def get_nested_config(depth: int):
+    config = {"value": 1}
+    for k in range(depth):
+        config = {f"key{k}": config, "other": k}
+    return config, ".".join(f"key{k}" for k in reversed(range(depth))) + ".value"
+
+
+@benchmark("config.try_get", sizes=[1, 5, 20])
+def bench_try_get(size):
+    from tbutils.config import try_get
+
+    config, key = get_nested_config(size)
+    return lambda: try_get(config, key)
+
+
+@benchmark("config.try_get_missing", sizes=[1, 5, 20])
+def bench_try_get_missing(size):
+    from tbutils.config import try_get
+
+    config, key = get_nested_config(size)
+    key = key.replace("value", "missing")
+    return lambda: try_get(config, key, default=0)
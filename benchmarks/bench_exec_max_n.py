@@ -0,0 +1,36 @@
+import contextlib
+import io
+
+from harness import benchmark
+
+
+@benchmark("exec_max_n.print_once_dedup", sizes=[10, 10000])
+def bench_print_once_dedup(size):
+    """Time the dedup check of print_once on an already printed message, with size messages already seen."""
+    from tbutils.exec_max_n import print_once
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(size):
+            print_once(f"bench_print_once_dedup message {i}")
+    return lambda: print_once("bench_print_once_dedup message 0")
+
+
+@benchmark("exec_max_n.print_once_discr_fn")
+def bench_print_once_discr_fn(size):
+    from tbutils.exec_max_n import print_once
+
+    discr_fn = lambda x: x // 10
+    with contextlib.redirect_stdout(io.StringIO()):
+        print_once("bench_print_once_discr_fn", discr_obj=5, discr_fn=discr_fn)
+    return lambda: print_once(
+        "bench_print_once_discr_fn", discr_obj=5, discr_fn=discr_fn
+    )
+
+
+@benchmark("exec_max_n.exec_once_exhausted")
+def bench_exec_once_exhausted(size):
+    from tbutils.exec_max_n import exec_once
+
+    func = exec_once(lambda: None)
+    func()
+    return func
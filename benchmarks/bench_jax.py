@@ -0,0 +1,29 @@
+from harness import benchmark
+
+
+def get_params(n_leaves: int):
+    import jax.numpy as jnp
+
+    return {f"layer{i}": [jnp.zeros(4)] for i in range(n_leaves)}
+
+
+@benchmark("jax.nest_for_array", sizes=[10, 100])
+def bench_nest_for_array(size):
+    import jax
+    from tbutils.jax import nest_for_array
+
+    func = nest_for_array(lambda arr, key_random: arr)
+    params = get_params(size)
+    key = jax.random.PRNGKey(0)
+    return lambda: jax.block_until_ready(func(params, key_random=key))
+
+
+@benchmark("jax.nest_for_pytree", sizes=[10, 100])
+def bench_nest_for_pytree(size):
+    import jax
+    from tbutils.jax import nest_for_pytree
+
+    func = nest_for_pytree(lambda arr, key_random: arr)
+    params = get_params(size)
+    key = jax.random.PRNGKey(0)
+    return lambda: jax.block_until_ready(func(params, key_random=key))
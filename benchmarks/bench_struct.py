@@ -0,0 +1,72 @@
+import numpy as np
+
+from harness import benchmark
+
+
+def get_nested_dict(n_leaves: int, width: int = 10):
+    """Return a nested dict of n_leaves numpy arrays, with width children per node."""
+    leaves = {f"leaf{i}": np.zeros(4) for i in range(n_leaves)}
+    while len(leaves) > width:
+        items = list(leaves.items())
+        leaves = {
+            f"node{i}": dict(items[i * width : (i + 1) * width])
+            for i in range((len(items) + width - 1) // width)
+        }
+    return leaves
+
+
+@benchmark("struct.get_dict_flattened", sizes=[10, 100, 1000])
+def bench_get_dict_flattened(size):
+    from tbutils.struct import get_dict_flattened
+
+    d = get_nested_dict(size)
+    return lambda: get_dict_flattened(d)
+
+
+@benchmark("struct.unflatten_dict", sizes=[10, 100, 1000])
+def bench_unflatten_dict(size):
+    from tbutils.struct import get_dict_flattened, unflatten_dict
+
+    d = get_dict_flattened(get_nested_dict(size))
+    return lambda: unflatten_dict(d)
+
+
+@benchmark("struct.get_shape_list", sizes=[10, 100])
+def bench_get_shape_list(size):
+    from tbutils.struct import get_shape
+
+    obj = [[0] * size for _ in range(size)]
+    return lambda: get_shape(obj)
+
+
+@benchmark("struct.get_shape_list_assert", sizes=[10, 100])
+def bench_get_shape_list_assert(size):
+    from tbutils.struct import get_shape
+
+    obj = [[0] * size for _ in range(size)]
+    return lambda: get_shape(obj, assert_same_shape=True)
+
+
+@benchmark("struct.get_shape_dict", sizes=[10, 100, 1000])
+def bench_get_shape_dict(size):
+    from tbutils.struct import get_shape
+
+    obj = {i: [1, 2, 3] for i in range(size)}
+    return lambda: get_shape(obj)
+
+
+@benchmark("struct.get_nbytes", sizes=[10, 100, 1000])
+def bench_get_nbytes(size):
+    from tbutils.struct import get_nbytes
+
+    d = get_nested_dict(size)
+    return lambda: get_nbytes(d)
+
+
+@benchmark("struct.NestedBuffer.add", sizes=[1, 10])
+def bench_nested_buffer_add(size):
+    from tbutils.struct import NestedBuffer
+
+    sample = {"obs": np.zeros(16), "info": {f"key{i}": 0.0 for i in range(size)}}
+    buffer = NestedBuffer(capacity=1024, overwrite=True)
+    return lambda: buffer.add(sample)
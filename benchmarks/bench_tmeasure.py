@@ -0,0 +1,23 @@
+from harness import benchmark
+
+
+@benchmark("tmeasure.RuntimeMeter")
+def bench_runtime_meter(size):
+    """Time the overhead of entering and exiting a RuntimeMeter stage."""
+    from tbutils.tmeasure import RuntimeMeter
+
+    def func():
+        with RuntimeMeter("bench_runtime_meter"):
+            pass
+
+    return func
+
+
+@benchmark("tmeasure.get_runtime_metrics", sizes=[10, 100])
+def bench_get_runtime_metrics(size):
+    from tbutils.tmeasure import RuntimeMeter, get_runtime_metrics
+
+    for i in range(size):
+        with RuntimeMeter(f"bench_get_runtime_metrics_{i}"):
+            pass
+    return get_runtime_metrics
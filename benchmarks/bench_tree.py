@@ -0,0 +1,19 @@
+from harness import benchmark
+from bench_struct import get_nested_dict
+
+
+@benchmark("tree.tree_map", sizes=[10, 100, 1000])
+def bench_tree_map(size):
+    from tbutils.tree import tree_map
+
+    tree = get_nested_dict(size)
+    return lambda: tree_map(lambda x: x, tree)
+
+
+@benchmark("tree.tree_map_treedef", sizes=[10, 100, 1000])
+def bench_tree_map_treedef(size):
+    from tbutils.tree import tree_map, tree_structure
+
+    tree = get_nested_dict(size)
+    treedef = tree_structure(tree)
+    return lambda: tree_map(lambda x: x, tree, treedef=treedef)
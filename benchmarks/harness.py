@@ -0,0 +1,59 @@
+import gc
+import timeit
+from typing import Any, Callable, Dict, List
+
+# Mapping from benchmark name to (setup function, list of sizes)
+BENCHMARKS: Dict[str, Dict[str, Any]] = {}
+
+
+def benchmark(name: str, sizes: List[Any] = (None,)):
+    """Decorator to register a benchmark.
+
+    The decorated function is called once per size with the size as argument (setup, not timed),
+    and must return the zero-argument callable to time.
+
+    @benchmark("struct.get_shape", sizes=[10, 1000])
+    def bench_get_shape(size):
+        obj = [[0] * size] * size
+        return lambda: get_shape(obj)
+
+    Args:
+        name (str): the name of the benchmark, of the form "module.function".
+        sizes (List[Any], optional): the input sizes to benchmark. Defaults to (None,).
+    """
+
+    def decorator(setup: Callable[[Any], Callable[[], Any]]):
+        assert name not in BENCHMARKS, f"Benchmark {name} is already registered"
+        BENCHMARKS[name] = {"setup": setup, "sizes": list(sizes)}
+        return setup
+
+    return decorator
+
+
+def get_benchmark_id(name: str, size: Any) -> str:
+    return name if size is None else f"{name}[size={size}]"
+
+
+def time_callable(
+    func: Callable[[], Any], n_repeats: int = 5, min_time: float = 0.2
+) -> Dict[str, float]:
+    """Time a callable : the number of loops is chosen so that one repeat lasts at least min_time,
+    and the best time per call over n_repeats repeats is reported (the least noisy estimator for micro-benchmarks).
+
+    Returns:
+        Dict[str, float]: a dictionnary with the best and median time per call in seconds, and the number of loops per repeat.
+    """
+    timer = timeit.Timer(func)
+    n_loops = 1
+    while True:
+        if timer.timeit(n_loops) >= min_time / 5:
+            break
+        n_loops *= 10
+    n_loops = max(1, int(n_loops * min_time / max(timer.timeit(n_loops), 1e-9)))
+    gc.collect()
+    times = sorted(time / n_loops for time in timer.repeat(n_repeats, n_loops))
+    return {
+        "time": times[0],
+        "time_median": times[len(times) // 2],
+        "n_loops": n_loops,
+    }
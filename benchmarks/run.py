@@ -0,0 +1,272 @@
+"""Performance benchmarks of the hot functions of tbutils.
+
+Run all benchmarks on the current tree and save the results as a baseline (benchmarks/baselines/<commit>.json):
+    python benchmarks/run.py run
+
+Run only some benchmarks (substring filter on their names):
+    python benchmarks/run.py run --filter struct
+
+Compare two baselines, given as JSON files or git commits (a missing baseline of a commit is computed in a temporary git worktree):
+    python benchmarks/run.py compare HEAD~1 HEAD
+
+Baselines are local to a machine and are not committed (benchmarks/baselines/ is git-ignored). Each baseline records its environment
+(machine and Python version): a cached baseline of a commit recorded in another environment is computed again,
+and comparing baselines of different environments prints a warning, as their timings are not comparable.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+DIR_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+DIR_REPO = os.path.dirname(DIR_BENCHMARKS)
+DIR_BASELINES = os.path.join(DIR_BENCHMARKS, "baselines")
+BENCHMARK_MODULES = [
+    "bench_config",
+    "bench_struct",
+    "bench_exec_max_n",
+    "bench_tmeasure",
+    "bench_tree",
+    "bench_jax",
+]
+
+
+def git(*args: str, cwd: str = DIR_REPO) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=cwd, capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def get_commit(ref: str = "HEAD", cwd: str = DIR_REPO) -> str:
+    """Return the full hash of a git ref, or "unknown" if not in a git repository."""
+    try:
+        return git("rev-parse", ref, cwd=cwd)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def get_environment() -> Dict[str, str]:
+    """Return the environment in which benchmarks are run, recorded in each baseline."""
+    return {
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}",
+    }
+
+
+def get_environment_differences(
+    baseline_old: Dict[str, Any], baseline_new: Dict[str, Any]
+) -> List[str]:
+    """Return the descriptions of the environment fields that differ between two baselines."""
+    return [
+        f"{name}: {baseline_old.get(name)} != {baseline_new.get(name)}"
+        for name in get_environment()
+        if baseline_old.get(name) != baseline_new.get(name)
+    ]
+
+
+def run_benchmarks(
+    tbutils_path: str,
+    filter_name: str = None,
+    n_repeats: int = 5,
+    min_time: float = 0.2,
+) -> Dict[str, Any]:
+    """Run the registered benchmarks against the tbutils package found in tbutils_path.
+    Benchmarks whose setup fails (e.g. a missing optional dependency, or a function absent in an older commit) are skipped.
+    """
+    sys.path.insert(0, tbutils_path)
+    from harness import BENCHMARKS, get_benchmark_id, time_callable
+
+    for module_name in BENCHMARK_MODULES:
+        importlib.import_module(module_name)
+
+    results, skipped = {}, {}
+    for name, benchmark in BENCHMARKS.items():
+        if filter_name is not None and filter_name not in name:
+            continue
+        for size in benchmark["sizes"]:
+            benchmark_id = get_benchmark_id(name, size)
+            try:
+                func = benchmark["setup"](size)
+            except Exception as e:
+                skipped[benchmark_id] = repr(e)
+                print(f"{benchmark_id:<50} skipped ({e!r})")
+                continue
+            results[benchmark_id] = time_callable(func, n_repeats, min_time)
+            print(f"{benchmark_id:<50} {results[benchmark_id]['time'] * 1e6:>12.3f} us")
+    return {
+        "commit": get_commit(cwd=tbutils_path),
+        **get_environment(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def get_baseline(ref: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Load a baseline from a JSON file, or from the baseline of a git commit,
+    computing it in a temporary worktree if missing or recorded in another environment.
+    """
+    if os.path.isfile(ref):
+        with open(ref, "r") as f:
+            return json.load(f)
+    commit = get_commit(ref)
+    assert commit != "unknown", f"{ref} is neither a baseline file nor a git commit"
+    # Partial baselines (with a filter) are stored apart from the full baseline of the commit
+    name = commit if args.filter is None else f"{commit}.filter-{args.filter}"
+    path = os.path.join(DIR_BASELINES, f"{name}.json")
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            baseline = json.load(f)
+        differences = get_environment_differences(baseline, get_environment())
+        if len(differences) == 0:
+            return baseline
+        print(
+            f"The baseline of {ref} ({commit[:8]}) was recorded in another environment ({', '.join(differences)}), running the benchmarks on it again:"
+        )
+    else:
+        print(f"No baseline for {ref} ({commit[:8]}), running the benchmarks on it:")
+    with tempfile.TemporaryDirectory() as dir_worktree:
+        git("worktree", "add", "--detach", dir_worktree, commit)
+        try:
+            command = [
+                sys.executable,
+                os.path.abspath(__file__),
+                "run",
+                "--tbutils-path",
+                dir_worktree,
+                "--output",
+                path,
+                "--n-repeats",
+                str(args.n_repeats),
+                "--min-time",
+                str(args.min_time),
+            ]
+            if args.filter is not None:
+                command += ["--filter", args.filter]
+            subprocess.run(command, check=True)
+        finally:
+            git("worktree", "remove", "--force", dir_worktree)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare_baselines(
+    baseline_old: Dict[str, Any],
+    baseline_new: Dict[str, Any],
+    threshold: float,
+    filter_name: str = None,
+) -> List[str]:
+    """Print the speedup of each benchmark between two baselines, and return the ids of the regressions."""
+    results_old, results_new = [
+        {
+            benchmark_id: result
+            for benchmark_id, result in baseline["results"].items()
+            if filter_name is None or filter_name in benchmark_id
+        }
+        for baseline in (baseline_old, baseline_new)
+    ]
+    print(
+        f"Comparing {baseline_old['commit'][:8]} (old) -> {baseline_new['commit'][:8]} (new), threshold {threshold:.0%}"
+    )
+    differences = get_environment_differences(baseline_old, baseline_new)
+    if len(differences) > 0:
+        print(
+            f"WARNING: the baselines were recorded in different environments ({', '.join(differences)}), speedups and regressions are not reliable"
+        )
+    print(f"{'benchmark':<50} {'old (us)':>12} {'new (us)':>12} {'speedup':>9}")
+    regressions = []
+    for benchmark_id in sorted(set(results_old) | set(results_new)):
+        if benchmark_id not in results_old or benchmark_id not in results_new:
+            time_old = results_old.get(benchmark_id, {}).get("time")
+            time_new = results_new.get(benchmark_id, {}).get("time")
+            status = "only in new" if time_old is None else "only in old"
+            time = time_new if time_old is None else time_old
+            print(f"{benchmark_id:<50} {status:>25} {time * 1e6:>9.3f} us")
+            continue
+        time_old = results_old[benchmark_id]["time"]
+        time_new = results_new[benchmark_id]["time"]
+        speedup = time_old / time_new
+        if speedup < 1 / (1 + threshold):
+            status = "REGRESSION"
+            regressions.append(benchmark_id)
+        elif speedup > 1 + threshold:
+            status = "improved"
+        else:
+            status = ""
+        print(
+            f"{benchmark_id:<50} {time_old * 1e6:>12.3f} {time_new * 1e6:>12.3f} {speedup:>8.2f}x {status}"
+        )
+    print(f"{len(regressions)} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ["run", "compare"]:
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument(
+            "--filter", default=None, help="only run benchmarks containing this name"
+        )
+        subparser.add_argument("--n-repeats", type=int, default=5)
+        subparser.add_argument("--min-time", type=float, default=0.2)
+        if command == "run":
+            subparser.add_argument(
+                "--output",
+                default=None,
+                help="the JSON file of the results. Defaults to benchmarks/baselines/<commit>.json",
+            )
+            subparser.add_argument(
+                "--tbutils-path",
+                default=DIR_REPO,
+                help="the directory containing the tbutils package to benchmark",
+            )
+        else:
+            subparser.add_argument("old", help="a baseline JSON file or a git commit")
+            subparser.add_argument("new", help="a baseline JSON file or a git commit")
+            subparser.add_argument(
+                "--threshold",
+                type=float,
+                default=0.1,
+                help="the relative change below which differences are considered noise",
+            )
+            subparser.add_argument(
+                "--fail-on-regression",
+                action="store_true",
+                help="exit with code 1 if there is a regression",
+            )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        baseline = run_benchmarks(
+            args.tbutils_path, args.filter, args.n_repeats, args.min_time
+        )
+        if args.output is None:
+            dirty = get_commit() != "unknown" and git(
+                "status", "--porcelain", "tbutils"
+            )
+            name = baseline["commit"] + ("-dirty" if dirty else "")
+            args.output = os.path.join(DIR_BASELINES, f"{name}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Results saved to {args.output}")
+    else:
+        baseline_old = get_baseline(args.old, args)
+        baseline_new = get_baseline(args.new, args)
+        regressions = compare_baselines(
+            baseline_old, baseline_new, args.threshold, args.filter
+        )
+        if args.fail_on_regression and len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
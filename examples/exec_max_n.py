@@ -60,3 +60,14 @@ if __name__ == "__main__":
     print(f"Testing discr_obj and discr_fn:")
     for k in [5, 9, 13, 14, 15, 16, 25]:
         print_once(f"A number of a new ten was detected : {k}", discr_obj=k, discr_fn=lambda x: x // 10)
+
+    # Test background printing and logging
+    from tbutils.exec_max_n import enable_background_printing, disable_background_printing, enable_background_logging
+
+    print(f"Testing background printing and logging:")
+    enable_background_printing(maxsize=100, overflow="drop")
+    for k in range(5):
+        print_once(f"Printed in the background : {k}")
+    disable_background_printing()  # flushes the queue
+    enable_background_logging(logger)
+    log_once(logger, "Logged in the background")
@@ -1,4 +1,16 @@
-from tbutils.info import check_versions
+from tbutils.info import check_versions, get_system_info
 
 if __name__ == "__main__":
-    check_versions()
\ No newline at end of file
+    check_versions()
+    print(f"{get_system_info()=}")
+
+    # CPU topology and thread budgets
+    from tbutils.info import get_cpu_topology, recommend_thread_config, benchmark_matmul
+
+    topology = get_cpu_topology()
+    print(f"{topology=}")
+    n_workers = max(2, topology["n_effective_physical"] // 2)
+    thread_config = recommend_thread_config(n_workers, topology=topology)
+    print(f"{thread_config=}")
+    print(f"Matmul benchmark with {n_workers} workers and default threads: {benchmark_matmul(n_workers)}")
+    print(f"Matmul benchmark with {n_workers} workers and recommended threads: {benchmark_matmul(n_workers, thread_config)}")
@@ -0,0 +1,32 @@
+import jax
+import jax.numpy as jnp
+
+from tbutils.jax_compile import CompilationWarmup
+
+
+def mlp(params, x):
+    for w in params:
+        x = jnp.tanh(x @ w)
+    return x.sum()
+
+
+def train_step(params, x):
+    grads = jax.grad(mlp)(params, x)
+    return [w - 0.01 * g for w, g in zip(params, grads)]
+
+
+if __name__ == "__main__":
+    # Run this script twice : the second run should load the executables from the persistent cache
+    warmup = CompilationWarmup()
+    params = [jax.ShapeDtypeStruct((256, 256), jnp.float32) for _ in range(8)]
+    warmup.register(train_step, params, jax.ShapeDtypeStruct((64, 256), jnp.float32))
+    warmup.register(mlp, params, jax.ShapeDtypeStruct((1024, 256), jnp.float32), name="eval_step")
+    report = warmup.warmup(parallel=True)
+    for name, stats in report["functions"].items():
+        print(f"{name}: {stats}")
+    print(f"Cache hits: {report['n_cache_hits']}/{report['n_compiled']}, warmup time: {report['warmup_time']:.3f}s")
+    print(f"Cache {report['cache_dir']}: {report['cache_n_entries']} entries, {report['cache_nbytes']} bytes")
+
+    # The compiled executables can be called directly on inputs of the registered shapes
+    train_step_compiled = warmup.get_compiled("train_step")
+    new_params = train_step_compiled([jnp.eye(256)] * 8, jnp.ones((64, 256)))
@@ -1,4 +1,36 @@
-from tbutils.jax import check_jax_device
+from tbutils.jax import check_jax_device, nest_for_array, nest_for_pytree
+from tbutils.tmeasure import RuntimeMeter
+
+import jax
+import jax.numpy as jnp
+from jax import random
+
+
+def add_noise(arr, key_random):
+    return arr + random.normal(key_random, arr.shape)
+
+
+def get_params(n_layers: int = 100):
+    return {f"layer_{i}": {"w": jnp.zeros((8, 8)), "b": [jnp.zeros(8)]} for i in range(n_layers)}
+
 
 if __name__ == "__main__":
     check_jax_device()
+
+    # Benchmark nest_for_array against nest_for_pytree on CPU
+    add_noise_array = nest_for_array(add_noise)
+    add_noise_pytree = nest_for_pytree(add_noise)
+    add_noise_pytree_jit = jax.jit(add_noise_pytree)
+    key = random.PRNGKey(0)
+    n_iterations = 10
+    for name, func in [
+        ("nest_for_array", add_noise_array),
+        ("nest_for_pytree", add_noise_pytree),
+        ("nest_for_pytree (jit)", add_noise_pytree_jit),
+    ]:
+        jax.block_until_ready(func(get_params(), key_random=key))  # warmup / compilation
+        for _ in range(n_iterations):
+            params = get_params()
+            with RuntimeMeter(name):
+                jax.block_until_ready(func(params, key_random=key))
+        print(f"{name}: {RuntimeMeter.get_averaged_stage_runtime(name) * 1000:.2f} ms per call (200 leaves)")
@@ -0,0 +1,44 @@
+import os
+
+# Simulate 4 devices on CPU (must be set before importing jax)
+os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=4"
+
+import time
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from tbutils.jax import DevicePrefetcher
+from tbutils.tmeasure import RuntimeMeter
+
+
+def get_batches(n_batches: int):
+    for i in range(n_batches):
+        time.sleep(0.02)  # host-side loading / collation
+        yield {"x": np.random.normal(size=(64, 512)).astype(np.float32), "y": [np.arange(64)]}
+
+
+@jax.jit
+def step(batch):
+    x = batch["x"]
+    for _ in range(10):
+        x = jnp.tanh(x @ jnp.ones((512, 512)) / 512)
+    return x.sum() + batch["y"][0].sum()
+
+
+if __name__ == "__main__":
+    print(f"Devices: {jax.devices()}")
+    step(next(get_batches(1)))  # compilation
+
+    with RuntimeMeter("without prefetching"):
+        for batch in get_batches(50):
+            step(batch).block_until_ready()
+    with RuntimeMeter("with prefetching"):
+        for batch in DevicePrefetcher(get_batches(50), size=3):
+            step(batch).block_until_ready()
+    with RuntimeMeter("with prefetching and sharding"):
+        for batch in DevicePrefetcher(get_batches(50), size=3, shard=True):
+            step(batch).block_until_ready()
+    print(f"Sharding of the last batch: {batch['x'].sharding}")
+    for stage_name, runtime in RuntimeMeter.get_runtimes().items():
+        print(f"{stage_name}: {runtime:.3f}s")
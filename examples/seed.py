@@ -6,4 +6,25 @@ if __name__ == "__main__":
     print(f"Try get seed on a config without seed: {try_get_seed({})}")
     print(f"Try get seed on a config with non-integer seed: {try_get_seed({'seed': '42'})}")
 
-    set_seed(42)
+    for profile in ["off", "fast", "strict"]:
+        changes = set_seed(42, profile=profile, verbose=True)
+
+    # Snapshot and restore of the RNG states
+    import random
+    import numpy as np
+    from tbutils.seed import get_rng_state, set_rng_state
+
+    rng = np.random.default_rng(0)
+    state = get_rng_state(generators={"rng": rng})
+    draws = (random.random(), np.random.rand(), rng.random())
+    set_rng_state(state, generators={"rng": rng})
+    print(f"Same draws after restoring the RNG state: {draws == (random.random(), np.random.rand(), rng.random())}")
+
+    # Independent per-worker seeding
+    from concurrent.futures import ThreadPoolExecutor
+    from tbutils.seed import spawn_seeds, spawn_generators, WorkerSeedInitializer, get_worker_generator
+
+    print(f"Seeds of 4 workers: {spawn_seeds(42, 4)}")
+    print(f"First draw of 4 Generators: {[rng.random() for rng in spawn_generators(42, 4)]}")
+    with ThreadPoolExecutor(4, initializer=WorkerSeedInitializer(42)) as executor:
+        print(f"Draws in 4 seeded threads: {list(executor.map(lambda _: get_worker_generator().random(), range(4)))}")
@@ -4,7 +4,7 @@ import importlib
 import numpy as np
 
 
-from tbutils.struct import get_dict_flattened, unflatten_dict, get_shape
+from tbutils.struct import get_dict_flattened, unflatten_dict, get_shape, get_nbytes
 
 if __name__ == "__main__":
     # Test get_dict_flattened and unflatten_dict
@@ -29,4 +29,33 @@ if __name__ == "__main__":
         print(f"{get_shape([[[None, None, None, None, None, None, None], [4]], [None, [7, 8]]], assert_same_shape=True)=}")
     except AssertionError as e:
         print(f"AssertionError was raised: {e}")
-    
\ No newline at end of file
+
+    # Test get_nbytes
+    buffer = np.zeros((1000, 10))
+    state = {"buffers": {"obs": buffer, "obs_last": buffer[-1]}, "config": {"lr": 0.1}, "shared": buffer}
+    print(f"{get_nbytes(state)=}")
+    print(f"{get_nbytes(state, max_depth=1)=}")
+    
+    # Test NestedBuffer
+    from tbutils.struct import NestedBuffer
+
+    buffer = NestedBuffer(capacity=4, overwrite=True)
+    for t in range(6):
+        buffer.add({"obs": np.full(2, t), "reward": float(t), "info": {"done": t % 3 == 0}})
+    print(f"{len(buffer)=}")
+    print(f"{buffer.get_views()=}")
+    print(f"{buffer.get_ordered()=}")
+    print(f"{buffer.sample(batch_size=2)=}")
+
+    # Test save_memmap, append_memmap and load_memmap
+    import os
+    import tempfile
+    from tbutils.struct import save_memmap, append_memmap, load_memmap
+
+    path = os.path.join(tempfile.mkdtemp(), "data.tbm")
+    save_memmap(path, {"obs": np.arange(12.0).reshape(3, 4), "info": {"done": np.array([False, False, True])}})
+    append_memmap(path, {"reward": np.ones(3)})
+    print(f"{load_memmap(path)=}")
+    print(f"{load_memmap(path, keys=['info'])=}")
+    # Views of the memory-mapped file only count their own bytes, not the whole file
+    print(f"{get_nbytes(load_memmap(path, keys=['info']))=}")
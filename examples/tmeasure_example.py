@@ -1,3 +1,4 @@
+import tempfile
 import time
 from tbutils.tmeasure import RuntimeMeter
 
@@ -16,4 +17,13 @@ if __name__ == "__main__":
 
     print(RuntimeMeter.get_stage_runtime("foo function"))
     print(RuntimeMeter.get_stage_runtime("bar function"))
-    print(RuntimeMeter.get_stage_runtime("total"))
\ No newline at end of file
+    print(RuntimeMeter.get_stage_runtime("total"))
+
+    # Save the profile of the calls of a stage that are 5 times slower than its average
+    RuntimeMeter.enable_slow_profiling(
+        "step", threshold_ratio=5, dir_profiles=tempfile.mkdtemp(), min_interval=0
+    )
+    for i in range(20):
+        with RuntimeMeter("step"):
+            foo() if i == 15 else time.sleep(0.01)
+    print(RuntimeMeter.get_slow_profiles("step"))
\ No newline at end of file
@@ -0,0 +1,26 @@
+from collections import namedtuple
+import numpy as np
+
+from tbutils.tree import tree_flatten, tree_unflatten, tree_map, tree_map_multi
+
+Transition = namedtuple("Transition", ["obs", "reward"])
+
+if __name__ == "__main__":
+    # Test tree_flatten and tree_unflatten
+    tree = {"params": [np.ones(2), np.zeros(3)], "transition": Transition(np.ones(4), 1.0)}
+    leaves, treedef = tree_flatten(tree)
+    print(f"Leaves: {leaves}")
+    print(f"Treedef: {treedef}")
+    print(f"Unflattened: {tree_unflatten(treedef, leaves)}")
+
+    # Test tree_map and tree_map_multi
+    print(f"{tree_map(lambda x: x * 2, tree)=}")
+    print(f"{tree_map_multi(lambda x, y: x + y, tree, tree)=}")
+
+    # Reuse the treedef on same-structured trees to skip structural inspection
+    for k in range(3):
+        tree_k = tree_map(lambda x: x + k, tree, treedef=treedef)
+    print(f"{tree_k=}")
+
+    # Batched leaf function : one call over all leaves
+    print(f"{tree_map(lambda leaves: [np.sum(leaf) for leaf in leaves], tree, batched=True)=}")
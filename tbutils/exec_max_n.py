@@ -1,6 +1,12 @@
+import atexit
 from collections import defaultdict
+import logging
 from logging import INFO, WARNING, Logger
-from typing import Any, Callable, Dict, Union
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import sys
+import threading
+from typing import Any, Callable, Dict, List, TextIO, Union
 
 
 def obj_to_discr_obj(obj: Any, discr_obj: Any, discr_fn: Callable[[Any], Any]) -> Any:
@@ -21,6 +27,272 @@ def obj_to_discr_obj(obj: Any, discr_obj: Any, discr_fn: Callable[[Any], Any]) -
     return discr_obj
 
 
+OVERFLOW_POLICIES = ("drop", "block")
+
+
+class BackgroundWriter:
+    """A writer that moves the writes to a text stream (stdout by default) to a background thread.
+
+    Messages are put in a bounded queue, and the thread drains it in batches, writing and flushing each batch at once,
+    so a slow stream (e.g. a pipe to a log collector) doesn't block the caller. When the queue is full, messages
+    are either dropped (and counted) or the caller blocks until there is room, depending on the overflow policy.
+    Errors of the stream (e.g. a broken pipe) are counted and the thread keeps draining, so callers never hang on a dead writer.
+    The queue is drained when the writer is closed, which is done automatically at exit.
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        stream: TextIO = None,
+        maxsize: int = 10000,
+        overflow: str = "block",
+        batch_size: int = 1000,
+    ):
+        """Initialize the BackgroundWriter and start its thread.
+
+        Args:
+            stream (TextIO, optional): the stream to write to. Defaults to None (sys.stdout at the time of each write).
+            maxsize (int, optional): the maximum number of messages waiting in the queue. Defaults to 10000.
+            overflow (str, optional): what to do when the queue is full, "drop" the message or "block" until there is room. Defaults to "block".
+            batch_size (int, optional): the maximum number of messages written at once. Defaults to 1000.
+        """
+        assert (
+            overflow in OVERFLOW_POLICIES
+        ), f"Unknown overflow policy {overflow}, should be one of {OVERFLOW_POLICIES}"
+        self.stream = stream
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.last_error: Exception = None
+        self.closed = False
+        # Held while queueing, so that no message is queued after the closing sentinel
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, text: str):
+        """Queue a message to be written, followed by a newline."""
+        with self.lock:
+            if not self.closed:
+                if self.overflow == "block":
+                    self.queue.put(text)
+                else:
+                    try:
+                        self.queue.put_nowait(text)
+                    except queue.Full:
+                        self.n_dropped += 1
+                return
+        print(text, file=self.stream)
+
+    def _write_batch(self, texts):
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write("".join(f"{text}\n" for text in texts))
+        stream.flush()
+
+    def _drain(self):
+        while True:
+            texts = [self.queue.get()]
+            while len(texts) < self.batch_size:
+                try:
+                    texts.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            is_closing = texts[-1] is self._CLOSE
+            if is_closing:
+                texts.pop()
+            if len(texts) > 0:
+                try:
+                    self._write_batch(texts)
+                except Exception as e:
+                    self.n_errors += 1
+                    self.last_error = e
+            if is_closing:
+                return
+
+    def close(self):
+        """Write all the queued messages and stop the thread. Later writes are done synchronously."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(self._CLOSE)
+        self.thread.join()
+        atexit.unregister(self.close)
+        warnings = []
+        if self.n_dropped > 0:
+            warnings.append(
+                f"[tbutils.exec_max_n WARNING] {self.n_dropped} messages were dropped because the output queue was full"
+            )
+        if self.n_errors > 0:
+            warnings.append(
+                f"[tbutils.exec_max_n WARNING] {self.n_errors} batches of messages could not be written: {self.last_error!r}"
+            )
+        if len(warnings) > 0:
+            try:
+                self._write_batch(warnings)
+            except Exception:
+                pass
+
+
+background_writer: BackgroundWriter = None
+
+
+def enable_background_printing(
+    stream: TextIO = None,
+    maxsize: int = 10000,
+    overflow: str = "block",
+    batch_size: int = 1000,
+) -> BackgroundWriter:
+    """Make print_max_n, print_once and the counters of exec_max_n print through a BackgroundWriter, so they don't block on I/O.
+
+    Args:
+        stream (TextIO, optional): the stream to write to. Defaults to None (sys.stdout).
+        maxsize (int, optional): the maximum number of messages waiting in the queue. Defaults to 10000.
+        overflow (str, optional): what to do when the queue is full, "drop" the message or "block" until there is room. Defaults to "block".
+        batch_size (int, optional): the maximum number of messages written at once. Defaults to 1000.
+
+    Returns:
+        BackgroundWriter: the background writer.
+    """
+    global background_writer
+    disable_background_printing()
+    background_writer = BackgroundWriter(stream, maxsize, overflow, batch_size)
+    return background_writer
+
+
+def disable_background_printing():
+    """Flush the background writer, if any, and go back to synchronous printing."""
+    global background_writer
+    if background_writer is not None:
+        background_writer.close()
+        background_writer = None
+
+
+def print_or_queue(obj: Any):
+    """Print an obj, through the background writer if background printing is enabled."""
+    if background_writer is None:
+        print(obj)
+    else:
+        background_writer.write(str(obj))
+
+
+class BoundedQueueHandler(QueueHandler):
+    """A QueueHandler with an overflow policy for its bounded queue : "drop" the record (and count it) or "block" until there is room."""
+
+    def __init__(self, queue_records: queue.Queue, overflow: str = "block"):
+        assert (
+            overflow in OVERFLOW_POLICIES
+        ), f"Unknown overflow policy {overflow}, should be one of {OVERFLOW_POLICIES}"
+        super().__init__(queue_records)
+        self.overflow = overflow
+        self.n_dropped = 0
+
+    def enqueue(self, record):
+        if self.overflow == "block":
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.n_dropped += 1
+
+
+def get_effective_handlers(logger: Logger) -> List[logging.Handler]:
+    """Return the handlers that handle the records of a logger : its own handlers and those of its ancestors, as long as records propagate.
+    If there are none, logging.lastResort is returned, as logging would.
+    """
+    handlers = []
+    current = logger
+    while current is not None:
+        handlers.extend(current.handlers)
+        if not current.propagate:
+            break
+        current = current.parent
+    if len(handlers) == 0 and logging.lastResort is not None:
+        handlers.append(logging.lastResort)
+    return handlers
+
+
+class BackgroundLogListener(QueueListener):
+    """The QueueListener returned by enable_background_logging. It runs the effective handlers of a logger in a background thread.
+
+    stop() handles all the queued records and gives the logger back its handlers and propagation. It is idempotent and called at exit.
+    """
+
+    def __init__(self, logger: Logger, maxsize: int = 10000, overflow: str = "block"):
+        """Initialize the BackgroundLogListener, without starting it.
+
+        Args:
+            logger (Logger): the logger whose handlers to move to the background.
+            maxsize (int, optional): the maximum number of records waiting in the queue. Defaults to 10000.
+            overflow (str, optional): what to do when the queue is full, "drop" the record or "block" until there is room. Defaults to "block".
+        """
+        assert not any(
+            isinstance(handler, BoundedQueueHandler) for handler in logger.handlers
+        ), f"Background logging is already enabled for logger {logger.name}"
+        queue_records = queue.Queue(maxsize=maxsize)
+        super().__init__(
+            queue_records, *get_effective_handlers(logger), respect_handler_level=True
+        )
+        self.logger = logger
+        self.queue_handler = BoundedQueueHandler(queue_records, overflow)
+        self.handlers_original = list(logger.handlers)
+        self.propagate_original = logger.propagate
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Replace the handlers of the logger by a BoundedQueueHandler, stop the propagation of its records
+        (the handlers of its ancestors are run by the listener) and start the background thread.
+        """
+        with self.lock:
+            for handler in self.handlers_original:
+                self.logger.removeHandler(handler)
+            self.logger.addHandler(self.queue_handler)
+            self.logger.propagate = False
+            super().start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Give the logger back its handlers, handle all the queued records and stop the background thread. Does nothing if already stopped."""
+        with self.lock:
+            if self._thread is None:
+                return
+            self.logger.removeHandler(self.queue_handler)
+            for handler in self.handlers_original:
+                self.logger.addHandler(handler)
+            self.logger.propagate = self.propagate_original
+            super().stop()
+            atexit.unregister(self.stop)
+
+
+def enable_background_logging(
+    logger: Logger,
+    maxsize: int = 10000,
+    overflow: str = "block",
+) -> BackgroundLogListener:
+    """Move the handling of the records of a logger to a background thread, so that log_max_n, log_once, warn_max_n and warn_once
+    (and any other logging call on this logger) don't block on I/O.
+    The effective handlers of the logger (its own and its ancestors', or logging.lastResort if there are none) are run by a listener
+    in a background thread. The logger gets a BoundedQueueHandler instead and stops propagating, so records are not handled twice.
+    Handlers added to the ancestors afterwards are not used until the listener is stopped.
+
+    Args:
+        logger (Logger): the logger whose records to handle in the background.
+        maxsize (int, optional): the maximum number of records waiting in the queue. Defaults to 10000.
+        overflow (str, optional): what to do when the queue is full, "drop" the record or "block" until there is room. Defaults to "block".
+
+    Returns:
+        BackgroundLogListener: the started listener. Call listener.stop() to flush it and restore the logger, which is done automatically at exit.
+    """
+    listener = BackgroundLogListener(logger, maxsize, overflow)
+    listener.start()
+    return listener
+
+
 dict_printing_objs_counter: Dict[str, int] = defaultdict(int)
 
 
@@ -45,9 +317,9 @@ def print_max_n(
     discr_obj = obj_to_discr_obj(obj, discr_obj, discr_fn)
     if dict_printing_objs_counter[discr_obj] < n:
         if show_counter:
-            print(f"{obj} ({dict_printing_objs_counter[discr_obj]+1}/{n})")
+            print_or_queue(f"{obj} ({dict_printing_objs_counter[discr_obj]+1}/{n})")
         else:
-            print(obj)
+            print_or_queue(obj)
         dict_printing_objs_counter[discr_obj] += 1
 
 
@@ -215,7 +487,9 @@ def exec_max_n(
             return
         if wrapper.counter > 0:
             if show_counter:
-                print(f"{func.__name__} was called ({n-wrapper.counter+1}/{n})")
+                print_or_queue(
+                    f"{func.__name__} was called ({n-wrapper.counter+1}/{n})"
+                )
             wrapper.counter -= 1
             return func(*args, **kwargs)
 
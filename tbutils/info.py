@@ -1,57 +1,597 @@
 import sys
+import os
+import glob
+import json
+import math
+import hashlib
 import platform
+import subprocess
+import time
 import importlib.util
+import importlib.metadata
+from typing import Any, Dict, List, Optional
+
+from tbutils.exec_max_n import print_once
 
 
 def is_installed(package_name):
     return importlib.util.find_spec(package_name) is not None
 
 
-def check_versions():
-    python_version = sys.version.split(" ")[0]
-    system_name = platform.system()
-    machine = platform.machine()
+# Mapping from the name of a package to the names of the distributions that can provide it
+PACKAGES_DISTRIBUTIONS: Dict[str, List[str]] = {
+    "numpy": ["numpy"],
+    "torch": ["torch"],
+    "tensorflow": [
+        "tensorflow",
+        "tensorflow-cpu",
+        "tensorflow-gpu",
+        "tensorflow-macos",
+    ],
+    "jax": ["jax"],
+    "jaxlib": ["jaxlib"],
+}
+
+# Code run in a subprocess to query the devices of each framework. It prints a JSON dict on its last line.
+DEVICE_PROBES_CODE: Dict[str, str] = {
+    "torch": (
+        "import json, torch\n"
+        "n = torch.cuda.device_count()\n"
+        "print(json.dumps({'cuda_available': torch.cuda.is_available(), 'cuda_version': torch.version.cuda,"
+        " 'gpus': [torch.cuda.get_device_name(i) for i in range(n)]}))"
+    ),
+    "tensorflow": (
+        "import json, tensorflow as tf\n"
+        "print(json.dumps({'built_with_cuda': tf.test.is_built_with_cuda(),"
+        " 'gpus': [str(gpu) for gpu in tf.config.list_physical_devices('GPU')]}))"
+    ),
+    "jax": (
+        "import json, jax\n"
+        "print(json.dumps({'devices': [repr(device) for device in jax.devices()], 'platform': jax.default_backend()}))"
+    ),
+}
+
+DEFAULT_INFO_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "tbutils", "system_info"
+)
+FINGERPRINT_ENV_VARIABLES = ["CUDA_VISIBLE_DEVICES", "JAX_PLATFORMS", "XLA_FLAGS"]
+
+
+def get_package_versions() -> Dict[str, Optional[str]]:
+    """Return the installed versions of the packages, read from their metadata without importing them.
+
+    Returns:
+        Dict[str, Optional[str]]: a dictionnary mapping each package name to its version, or None if it is not installed.
+    """
+    versions = {}
+    for package_name, distributions in PACKAGES_DISTRIBUTIONS.items():
+        versions[package_name] = None
+        for distribution in distributions:
+            try:
+                versions[package_name] = importlib.metadata.version(distribution)
+                break
+            except importlib.metadata.PackageNotFoundError:
+                continue
+    return versions
+
+
+def get_environment_fingerprint(versions: Dict[str, Optional[str]]) -> str:
+    """Return a hash identifying the environment : machine, python interpreter, package versions and device-related env variables."""
+    environment = {
+        "node": platform.node(),
+        "executable": sys.executable,
+        "python": sys.version,
+        "versions": versions,
+        "env": {name: os.environ.get(name) for name in FINGERPRINT_ENV_VARIABLES},
+    }
+    return hashlib.sha256(
+        json.dumps(environment, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def probe_devices(
+    package_names: List[str], timeout: float = 30.0
+) -> Dict[str, Dict[str, Any]]:
+    """Query the devices of several frameworks, each in its own subprocess, in parallel.
+    The current process imports nothing.
+
+    Args:
+        package_names (List[str]): the frameworks to query, among the keys of DEVICE_PROBES_CODE.
+        timeout (float, optional): the maximum time in seconds to wait for all the queries. Defaults to 30.0.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: a dictionnary mapping each framework to its device information, or to {"error": ...} if the query failed.
+    """
+    processes = {
+        package_name: subprocess.Popen(
+            [sys.executable, "-c", DEVICE_PROBES_CODE[package_name]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for package_name in package_names
+    }
+    results = {}
+    time_deadline = time.monotonic() + timeout
+    for package_name, process in processes.items():
+        try:
+            stdout, stderr = process.communicate(
+                timeout=max(time_deadline - time.monotonic(), 0)
+            )
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            results[package_name] = {"error": f"timeout after {timeout}s"}
+            continue
+        lines = stdout.strip().splitlines()
+        try:
+            results[package_name] = json.loads(lines[-1])
+        except (IndexError, json.JSONDecodeError):
+            error_lines = stderr.strip().splitlines()
+            results[package_name] = {
+                "error": (
+                    error_lines[-1]
+                    if error_lines
+                    else f"exit code {process.returncode}"
+                )
+            }
+    return results
+
+
+def get_system_info(
+    probe_device: bool = True,
+    use_cache: bool = True,
+    cache_dir: str = None,
+    timeout: float = 30.0,
+) -> Dict[str, Any]:
+    """Return information about the system, the installed package versions and the devices available to each framework.
+
+    Versions are read with importlib.metadata, without importing any package. Device queries are run in parallel subprocesses
+    with a timeout, and their successful results are cached on disk per environment fingerprint, so repeated launches are near-instant.
+    Failed queries are not cached, and are run again at the next call.
+
+    Args:
+        probe_device (bool, optional): whether to query the devices of torch, tensorflow and jax. Defaults to True.
+        use_cache (bool, optional): whether to read and write the device information from/to the cache. Defaults to True.
+        cache_dir (str, optional): the cache directory. Defaults to None (~/.cache/tbutils/system_info).
+        timeout (float, optional): the maximum time in seconds to wait for the device queries. Defaults to 30.0.
+
+    Returns:
+        Dict[str, Any]: a dictionnary with keys "os", "machine", "python", "versions" (package -> version or None),
+        "devices" (framework -> device information) and "fingerprint".
+    """
+    versions = get_package_versions()
+    fingerprint = get_environment_fingerprint(versions)
+    info = {
+        "os": platform.system(),
+        "machine": platform.machine(),
+        "python": sys.version.split(" ")[0],
+        "versions": versions,
+        "devices": {},
+        "fingerprint": fingerprint,
+    }
+    if not probe_device:
+        return info
+
+    cache_dir = DEFAULT_INFO_CACHE_DIR if cache_dir is None else cache_dir
+    cache_path = os.path.join(cache_dir, f"{fingerprint}.json")
+    devices_cached = {}
+    if use_cache and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                devices_cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    package_names = [name for name in DEVICE_PROBES_CODE if versions[name] is not None]
+    package_names_to_probe = [
+        name for name in package_names if name not in devices_cached
+    ]
+    devices_probed = probe_devices(package_names_to_probe, timeout=timeout)
+    info["devices"] = {
+        name: devices_cached.get(name, devices_probed.get(name))
+        for name in package_names
+    }
+    # Failures (timeouts, driver not loaded yet, ...) may be transient, so only successful probes are cached
+    devices_succeeded = {
+        name: devices
+        for name, devices in devices_probed.items()
+        if "error" not in devices
+    }
+    if use_cache and len(devices_succeeded) > 0:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_path_tmp = f"{cache_path}.{os.getpid()}.tmp"
+            with open(cache_path_tmp, "w") as f:
+                json.dump({**devices_cached, **devices_succeeded}, f)
+            os.replace(cache_path_tmp, cache_path)
+        except OSError:
+            pass
+    return info
+
+
+def check_versions(**kwargs) -> Dict[str, Any]:
+    """Print the system info, the versions of numpy/torch/tensorflow/JAX and their devices, and return them.
+    Nothing is imported : see get_system_info, to which kwargs are passed.
+
+    Returns:
+        Dict[str, Any]: the system info, as returned by get_system_info.
+    """
+    info = get_system_info(**kwargs)
+    versions, devices = info["versions"], info["devices"]
 
     print("\n============== Checking Packages & System Info ================")
-    print(f"OS: {system_name} ({machine})")
-    print(f"Python: {python_version}")
+    print(f"OS: {info['os']} ({info['machine']})")
+    print(f"Python: {info['python']}")
 
     # NumPy
-    if is_installed("numpy"):
-        import numpy as np
-
-        print(f"NumPy: {np.__version__}")
+    if versions["numpy"] is not None:
+        print(f"NumPy: {versions['numpy']}")
 
     # PyTorch
-    if is_installed("torch"):
-        import torch
+    if versions["torch"] is not None:
+        print(f"PyTorch: {versions['torch']}")
+        torch_devices = devices.get("torch", {})
+        if "error" in torch_devices:
+            print(f"\tError while checking devices: {torch_devices['error']}")
+        elif torch_devices:
+            print(f"\tCUDA Available: {torch_devices['cuda_available']}")
+            print(
+                f"\tCUDA Version: {torch_devices['cuda_version'] if torch_devices['cuda_available'] else 'N/A'}"
+            )
+            print(f"\tAvailable GPUs: {len(torch_devices['gpus'])}")
+            for i, gpu_name in enumerate(torch_devices["gpus"]):
+                print(f"\t  - GPU {i}: {gpu_name}")
+
+    # TensorFlow
+    if versions["tensorflow"] is not None:
+        print(f"TensorFlow: {versions['tensorflow']}")
+        tf_devices = devices.get("tensorflow", {})
+        if "error" in tf_devices:
+            print(f"\tError while checking devices: {tf_devices['error']}")
+        elif tf_devices:
+            print(f"\tCUDA Available: {tf_devices['built_with_cuda']}")
+            print(f"\tAvailable GPUs: {len(tf_devices['gpus'])}")
+            for gpu in tf_devices["gpus"]:
+                print(f"\t  - {gpu}")
+
+    # JAX
+    if versions["jax"] is not None:
+        print(f"JAX: {versions['jax']}")
+        jax_devices = devices.get("jax", {})
+        if "error" in jax_devices:
+            print(f"\tError while checking devices: {jax_devices['error']}")
+        elif jax_devices:
+            print(f"\tAvailable Devices: [{', '.join(jax_devices['devices'])}]")
+            print(f"\tPlatform: {jax_devices['platform']}")
+
+    print("===============================================================")
+    return info
+
+
+def _read_file(path: str) -> Optional[str]:
+    """Return the stripped content of a file, or None if it can't be read."""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parse a Linux cpu list such as "0-3,8,10-11" into a list of cpu ids."""
+    cpus = []
+    for part in cpu_list.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def get_cgroup_cpu_quota() -> Optional[float]:
+    """Return the number of CPUs allowed by the cgroup CPU quota (v2 or v1) of the process, or None if there is no quota."""
+    cpu_max = _read_file(
+        "/sys/fs/cgroup/cpu.max"
+    )  # cgroup v2, "<quota> <period>" or "max <period>"
+    if cpu_max is not None:
+        quota, period = cpu_max.split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    quota = _read_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")  # cgroup v1
+    period = _read_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota is not None and period is not None and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
 
-        print(f"PyTorch: {torch.__version__}")
-        print(f"\tCUDA Available: {torch.cuda.is_available()}")
-        print(
-            f"\tCUDA Version: {torch.version.cuda if torch.cuda.is_available() else 'N/A'}"
+def get_cpu_topology() -> Dict[str, Any]:
+    """Return the CPU topology of the machine, as seen by the process. Detailed information is only available on Linux.
+
+    Returns:
+        Dict[str, Any]: a dictionnary with keys
+            "n_logical" : the number of logical cores of the machine,
+            "n_physical" : the number of physical cores of the machine,
+            "available_cpus" : the ids of the logical cores the process is allowed to run on,
+            "cgroup_quota" : the number of CPUs allowed by the cgroup quota, or None,
+            "n_effective" : the number of cores the process can actually use, from the affinity and the quota,
+            "n_effective_physical" : the number of physical cores among the available ones, capped by the quota,
+            "numa_nodes" : a dictionnary mapping each NUMA node id to its cpu ids,
+            "caches" : a list of {"level", "type", "size"} for the caches of cpu 0.
+    """
+    n_logical = os.cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        available_cpus = sorted(os.sched_getaffinity(0))
+    else:
+        available_cpus = list(range(n_logical))
+
+    # Physical cores, identified by (package id, core id)
+    cpu_to_core = {}
+    for cpu in range(n_logical):
+        core_id = _read_file(f"/sys/devices/system/cpu/cpu{cpu}/topology/core_id")
+        package_id = _read_file(
+            f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id"
+        )
+        if core_id is not None:
+            cpu_to_core[cpu] = (package_id, core_id)
+    if len(cpu_to_core) > 0:
+        n_physical = len(set(cpu_to_core.values()))
+        n_available_physical = len(
+            {cpu_to_core.get(cpu, ("cpu", cpu)) for cpu in available_cpus}
         )
-        print(f"\tAvailable GPUs: {torch.cuda.device_count()}")
-        for i in range(torch.cuda.device_count()):
-            print(f"\t  - GPU {i}: {torch.cuda.get_device_name(i)}")
+    else:
+        n_physical = n_logical
+        n_available_physical = len(available_cpus)
 
-    # TensorFlow
-    if is_installed("tensorflow"):
-        import tensorflow as tf
+    cgroup_quota = get_cgroup_cpu_quota()
+    n_effective = len(available_cpus)
+    n_effective_physical = n_available_physical
+    if cgroup_quota is not None:
+        n_effective = max(1, min(n_effective, math.ceil(cgroup_quota)))
+        n_effective_physical = max(
+            1, min(n_effective_physical, math.ceil(cgroup_quota))
+        )
 
-        print(f"TensorFlow: {tf.__version__}")
-        print(f"\tCUDA Available: {tf.test.is_built_with_cuda()}")
-        print(f"\tAvailable GPUs: {len(tf.config.list_physical_devices('GPU'))}")
-        for gpu in tf.config.list_physical_devices("GPU"):
-            print(f"\t  - {gpu}")
+    numa_nodes = {}
+    for node_path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*")):
+        cpu_list = _read_file(os.path.join(node_path, "cpulist"))
+        if cpu_list is not None:
+            numa_nodes[int(os.path.basename(node_path)[4:])] = _parse_cpu_list(cpu_list)
 
-    # JAX
-    if is_installed("jax"):
-        import jax
-        from jax.lib import xla_bridge
+    caches = []
+    for cache_path in sorted(
+        glob.glob("/sys/devices/system/cpu/cpu0/cache/index[0-9]*")
+    ):
+        caches.append(
+            {
+                "level": _read_file(os.path.join(cache_path, "level")),
+                "type": _read_file(os.path.join(cache_path, "type")),
+                "size": _read_file(os.path.join(cache_path, "size")),
+            }
+        )
 
-        print(f"JAX: {jax.__version__}")
-        print(f"\tAvailable Devices: {jax.devices()}")
-        print(f"\tPlatform: {xla_bridge.get_backend().platform}")
+    return {
+        "n_logical": n_logical,
+        "n_physical": n_physical,
+        "available_cpus": available_cpus,
+        "cgroup_quota": cgroup_quota,
+        "n_effective": n_effective,
+        "n_effective_physical": n_effective_physical,
+        "numa_nodes": numa_nodes,
+        "caches": caches,
+    }
 
-    print("===============================================================")
+
+THREADS_ENV_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+# XLA flags managed by recommend_thread_config. intra_op_parallelism_threads is a TensorFlow setting that older versions
+# wrongly put in XLA_FLAGS (XLA reads it as a flags file and aborts), it is only listed here to be removed.
+XLA_THREAD_FLAGS = ["xla_cpu_multi_thread_eigen", "intra_op_parallelism_threads"]
+
+
+def _update_xla_flags(xla_flags: str, flags: Dict[str, Optional[str]]) -> str:
+    """Return the XLA_FLAGS string xla_flags with the given flags replaced, without duplicating them.
+
+    Args:
+        xla_flags (str): the current XLA_FLAGS, e.g. "--xla_force_host_platform_device_count=4".
+        flags (Dict[str, Optional[str]]): the flags to set, mapping their name (without "--") to their value, or to None to remove them.
+
+    Returns:
+        str: the new XLA_FLAGS.
+    """
+    kept = [
+        flag
+        for flag in xla_flags.split()
+        if flag.lstrip("-").split("=")[0] not in flags
+    ]
+    kept += [f"--{name}={value}" for name, value in flags.items() if value is not None]
+    return " ".join(kept)
+
+
+def recommend_thread_config(
+    n_workers: int = 1,
+    use_physical_cores: bool = True,
+    topology: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """Recommend a thread budget per worker process so that n_workers processes together don't oversubscribe the cores.
+
+    Args:
+        n_workers (int, optional): the number of worker processes that will run concurrently. Defaults to 1.
+        use_physical_cores (bool, optional): whether to budget physical cores only (hyperthreads rarely help BLAS). Defaults to True.
+        topology (Dict[str, Any], optional): the CPU topology, as returned by get_cpu_topology. Defaults to None (detected).
+
+    Returns:
+        Dict[str, Any]: a dictionnary with keys "n_workers", "n_threads" (per worker), "env" (the environment variables to set,
+        for OpenMP, MKL, OpenBLAS, Accelerate, numexpr and XLA) and "torch_threads".
+        XLA has no flag for the size of its CPU thread pool, which follows the CPU affinity of the process : with one thread
+        per worker, its multi-threaded Eigen kernels are disabled, else use pin_affinity in apply_thread_config to bound it.
+    """
+    assert n_workers > 0, f"The number of workers should be positive, got {n_workers}"
+    if topology is None:
+        topology = get_cpu_topology()
+    n_cores = topology["n_effective_physical" if use_physical_cores else "n_effective"]
+    n_threads = max(1, n_cores // n_workers)
+    env = {name: str(n_threads) for name in THREADS_ENV_VARIABLES}
+    xla_flags = {name: None for name in XLA_THREAD_FLAGS}
+    if n_threads == 1:
+        xla_flags["xla_cpu_multi_thread_eigen"] = "false"
+    env["XLA_FLAGS"] = _update_xla_flags(os.environ.get("XLA_FLAGS", ""), xla_flags)
+    return {
+        "n_workers": n_workers,
+        "n_threads": n_threads,
+        "env": env,
+        "torch_threads": n_threads,
+    }
+
+
+def apply_thread_config(
+    thread_config: Dict[str, Any],
+    worker_id: int = None,
+    pin_affinity: bool = False,
+    topology: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """Apply a thread config (from recommend_thread_config) to the current process.
+
+    Environment variables are only read by BLAS/OpenMP/XLA when they are loaded, so this should be called at the start
+    of each worker, before importing numpy, torch or jax. If torch is already imported, torch.set_num_threads is called.
+
+    Args:
+        thread_config (Dict[str, Any]): the thread config, as returned by recommend_thread_config.
+        worker_id (int, optional): the id of the worker in [0, n_workers), required to pin the affinity. Defaults to None.
+        pin_affinity (bool, optional): whether to pin the process to its own n_threads cores (Linux only). Defaults to False.
+        topology (Dict[str, Any], optional): the CPU topology, as returned by get_cpu_topology. Defaults to None (detected).
+
+    Returns:
+        Dict[str, Any]: the changes made, mapping each changed setting to its (old value, new value).
+    """
+    changes = {}
+    for name, value in thread_config["env"].items():
+        if os.environ.get(name) != value:
+            changes[name] = (os.environ.get(name), value)
+            os.environ[name] = value
+
+    libraries_loaded = [name for name in ("numpy", "jax") if name in sys.modules]
+    if len(libraries_loaded) > 0:
+        print_once(
+            f"[tbutils.info WARNING] {libraries_loaded} already imported, thread environment variables may not be taken into account"
+        )
+
+    if "torch" in sys.modules:
+        import torch
+
+        n_threads_old = torch.get_num_threads()
+        if n_threads_old != thread_config["torch_threads"]:
+            torch.set_num_threads(thread_config["torch_threads"])
+            changes["torch_threads"] = (n_threads_old, thread_config["torch_threads"])
+
+    if pin_affinity:
+        assert worker_id is not None, "worker_id is required to pin the CPU affinity"
+        assert hasattr(
+            os, "sched_setaffinity"
+        ), "CPU affinity is only supported on Linux"
+        if topology is None:
+            topology = get_cpu_topology()
+        cpus = topology["available_cpus"]
+        n_threads = thread_config["n_threads"]
+        start = (worker_id * n_threads) % len(cpus)
+        cpus_worker = [cpus[(start + i) % len(cpus)] for i in range(n_threads)]
+        cpus_old = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, cpus_worker)
+        changes["affinity"] = (cpus_old, cpus_worker)
+    return changes
+
+
+MATMUL_BENCHMARK_CODE = (
+    "import time, numpy as np\n"
+    "a = np.random.rand({size}, {size}).astype(np.float32)\n"
+    "a @ a\n"
+    "t = time.perf_counter()\n"
+    "for _ in range({n_repeats}): a @ a\n"
+    "print(time.perf_counter() - t)"
+)
+
+
+def benchmark_matmul(
+    n_workers: int = 1,
+    thread_config: Dict[str, Any] = None,
+    size: int = 1024,
+    n_repeats: int = 10,
+    timeout: float = 120.0,
+) -> Dict[str, Any]:
+    """Run a numpy matmul benchmark in n_workers concurrent processes, to measure the effect of a thread config.
+
+    Each worker is a fresh subprocess, so the thread environment variables are applied before numpy is loaded.
+    Comparing thread_config=None (library defaults) with recommend_thread_config(n_workers) shows the cost of oversubscription.
+
+    Args:
+        n_workers (int, optional): the number of concurrent worker processes. Defaults to 1.
+        thread_config (Dict[str, Any], optional): the thread config of each worker. Defaults to None (the current environment).
+        size (int, optional): the size of the square float32 matrices. Defaults to 1024.
+        n_repeats (int, optional): the number of matmuls per worker. Defaults to 10.
+        timeout (float, optional): the maximum time in seconds to wait for the workers. Workers still running after it are killed. Defaults to 120.0.
+
+    Returns:
+        Dict[str, Any]: a dictionnary with the wall time "time_max" of the slowest worker, its "time_mean" over workers and the total "gflops" throughput
+        of the workers that succeeded (None if none did), the number of failed workers "n_failed" and their "errors" (worker index -> error message).
+    """
+    env = dict(os.environ)
+    if thread_config is not None:
+        env.update(thread_config["env"])
+    code = MATMUL_BENCHMARK_CODE.format(size=size, n_repeats=n_repeats)
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", code],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(n_workers)
+    ]
+    times, errors = [], {}
+    time_deadline = time.monotonic() + timeout
+    for worker_id, process in enumerate(processes):
+        try:
+            stdout, stderr = process.communicate(
+                timeout=max(time_deadline - time.monotonic(), 0)
+            )
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            errors[worker_id] = f"timeout after {timeout}s"
+            continue
+        try:
+            times.append(float(stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            error_lines = stderr.strip().splitlines()
+            errors[worker_id] = (
+                error_lines[-1] if error_lines else f"exit code {process.returncode}"
+            )
+    if len(errors) > 0:
+        print_once(
+            f"[tbutils.info WARNING] {len(errors)}/{n_workers} matmul benchmark workers failed: {errors}"
+        )
+    if len(times) == 0:
+        return {
+            "time_max": None,
+            "time_mean": None,
+            "gflops": None,
+            "n_failed": len(errors),
+            "errors": errors,
+        }
+    n_flops = 2 * size**3 * n_repeats * len(times)
+    return {
+        "time_max": max(times),
+        "time_mean": sum(times) / len(times),
+        "gflops": n_flops / max(times) / 1e9,
+        "n_failed": len(errors),
+        "errors": errors,
+    }
@@ -1,5 +1,7 @@
-import importlib
-from typing import Any, Dict, List, Union
+import importlib.util
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Union
 from abc import ABC, abstractmethod
 from functools import partial
 
@@ -8,20 +10,20 @@ if importlib.util.find_spec("jax") is not None:
     from jax import random
     import jax.numpy as jnp
     import numpy as np
-    from jax.lib import xla_bridge
 
 
 def check_jax_device():
     try:
         print("Checking device used by JAX:")
         print(f"\tAvailable devices: {jax.devices()}")
-        print(f"\tPlatform: {xla_bridge.get_backend().platform}")
+        print(f"\tPlatform: {jax.default_backend()}")
     except Exception as e:
         print(f"Error while checking JAX device: {e}")
 
 
 def nest_for_array(func):
     """Decorator to allow a function to be applied to nested arrays.
+    The nested dicts and lists are modified in place. See nest_for_pytree for a non-mutating, jit-compatible version.
 
     Args:
         func (function): the function to decorate
@@ -59,3 +61,162 @@ def nest_for_array(func):
             raise ValueError(f"Unknown type for array: {type(arr)}")
 
     return wrapper
+
+
+def nest_for_pytree(func):
+    """Decorator to allow a function to be applied to every array leaf of a pytree (nested dicts, lists, tuples, namedtuples, ...).
+
+    Unlike nest_for_array, the input tree is not modified and a new tree is returned, and the traversal relies on jax.tree_util,
+    so the decorated function can be used inside jax.jit and jax.vmap.
+    If key_random is given, all the subkeys are split at once with a single random.split(key_random, n_leaves) call,
+    and each leaf receives its own subkey as the key_random argument.
+
+    @nest_for_pytree
+    def add_noise(arr, key_random):
+        return arr + random.normal(key_random, arr.shape)
+
+    params_noisy = add_noise(params, key_random=key)
+
+    Args:
+        func (function): the function to decorate, applied as func(leaf, *args, **kwargs)
+
+    Returns:
+        function: the decorated function
+    """
+
+    def wrapper(tree, *args, key_random=None, **kwargs):
+        leaves, treedef = jax.tree_util.tree_flatten(tree)
+        if key_random is None:
+            new_leaves = [func(leaf, *args, **kwargs) for leaf in leaves]
+        elif len(leaves) == 0:
+            new_leaves = []
+        else:
+            subkeys = random.split(key_random, len(leaves))
+            new_leaves = [
+                func(leaf, *args, key_random=subkey, **kwargs)
+                for leaf, subkey in zip(leaves, subkeys)
+            ]
+        return jax.tree_util.tree_unflatten(treedef, new_leaves)
+
+    return wrapper
+
+
+class DevicePrefetcher:
+    """An iterator that collates and transfers the next batches to the device(s) in a background thread,
+    so that host-side work and host-to-device transfers overlap with the computation on the current batch.
+
+    Batches can be any pytree of arrays. If shard is True, each leaf is split along its first axis across the devices,
+    so that a jitted function called on the batch runs data-parallel.
+
+    for batch in DevicePrefetcher(iterator_numpy_batches, size=2):
+        state = train_step(state, batch)  # batch is already on device
+    """
+
+    _END = object()
+
+    def __init__(
+        self,
+        iterator: Iterable[Any],
+        size: int = 2,
+        collate_fn: Callable[[Any], Any] = None,
+        devices: Sequence[Any] = None,
+        shard: bool = False,
+    ):
+        """Initialize the DevicePrefetcher and start its background thread.
+
+        Args:
+            iterator (Iterable[Any]): the iterable of batches (pytrees of numpy arrays or any array-like).
+            size (int, optional): the number of batches prefetched in advance. Defaults to 2.
+            collate_fn (Callable[[Any], Any], optional): a function applied to each batch in the background thread before the transfer. Defaults to None.
+            devices (Sequence[Any], optional): the devices to transfer to. Defaults to None (jax.devices() if shard, else the default device).
+            shard (bool, optional): whether to shard each leaf along its first axis across the devices. Defaults to False.
+        """
+        assert size > 0, f"The prefetch size should be positive, got {size}"
+        self.iterator = iter(iterator)
+        self.collate_fn = collate_fn
+        if shard:
+            devices = jax.devices() if devices is None else list(devices)
+            mesh = jax.sharding.Mesh(np.array(devices), ("batch",))
+            self.sharding = jax.sharding.NamedSharding(
+                mesh, jax.sharding.PartitionSpec("batch")
+            )
+        elif devices is not None:
+            assert len(devices) == 1, "Several devices require shard=True"
+            self.sharding = devices[0]
+        else:
+            self.sharding = None
+        self.queue = queue.Queue(maxsize=size)
+        self.event_stop = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _transfer(self, batch: Any) -> Any:
+        """Transfer a batch to the device(s) and wait for the transfer to complete."""
+        if self.collate_fn is not None:
+            batch = self.collate_fn(batch)
+        batch = jax.tree_util.tree_map(
+            lambda leaf: jax.device_put(leaf, self.sharding), batch
+        )
+        return jax.block_until_ready(batch)
+
+    def _put(self, item: Any) -> bool:
+        """Put an item in the queue, and return False if the prefetcher was closed meanwhile."""
+        while not self.event_stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for batch in self.iterator:
+                if not self._put(self._transfer(batch)):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        if self.event_stop.is_set():
+            raise StopIteration
+        item = self.queue.get()
+        if item is self._END:
+            self.event_stop.set()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.event_stop.set()
+            raise item
+        return item
+
+    def close(self, timeout: float = 1.0) -> bool:
+        """Stop the background thread and discard the prefetched batches.
+
+        The thread can only stop between two batches of the source iterator : if it is blocked in the source (e.g. waiting on a network queue),
+        it is left behind (as a daemon thread) and stops after the next batch of the source, without waiting for it.
+
+        Args:
+            timeout (float, optional): the maximum time in seconds to wait for the thread to stop. Defaults to 1.0.
+
+        Returns:
+            bool: whether the thread has stopped.
+        """
+        self.event_stop.set()
+        self.thread.join(timeout)
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        return not self.thread.is_alive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,297 @@
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+if importlib.util.find_spec("jax") is not None:
+    import jax
+
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "tbutils", "jax_compilation_cache"
+)
+EVENT_CACHE_HIT = "/jax/compilation_cache/cache_hits"
+EVENT_CACHE_MISS = "/jax/compilation_cache/cache_misses"
+
+
+def setup_compilation_cache(
+    cache_dir: str = None,
+    min_compile_time_secs: float = None,
+    min_entry_size_bytes: int = None,
+) -> str:
+    """Configure the persistent compilation cache of JAX in a managed directory.
+    It should be called before the first compilation of the process, as JAX initializes its cache only once.
+
+    Args:
+        cache_dir (str, optional): the cache directory. Defaults to None (the env variable TBUTILS_JAX_CACHE_DIR if set, else ~/.cache/tbutils/jax_compilation_cache).
+        min_compile_time_secs (float, optional): only cache executables that took at least this time to compile, for the whole process.
+            Defaults to None (keep the threshold of JAX, 1 second by default, so that small eager compilations are not written to disk).
+        min_entry_size_bytes (int, optional): only cache executables of at least this size. Defaults to None (keep the threshold of JAX).
+
+    Returns:
+        str: the cache directory.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get("TBUTILS_JAX_CACHE_DIR", DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    if min_compile_time_secs is not None:
+        jax.config.update(
+            "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs
+        )
+    if min_entry_size_bytes is not None:
+        jax.config.update(
+            "jax_persistent_cache_min_entry_size_bytes", min_entry_size_bytes
+        )
+    return cache_dir
+
+
+def get_cache_size(cache_dir: str = None) -> Dict[str, int]:
+    """Return the size on disk of a compilation cache directory.
+
+    Args:
+        cache_dir (str, optional): the cache directory. Defaults to None (the directory currently configured in JAX).
+
+    Returns:
+        Dict[str, int]: a dictionnary with the number of files "n_entries" and their total size "nbytes".
+    """
+    if cache_dir is None:
+        cache_dir = jax.config.jax_compilation_cache_dir
+    n_entries, nbytes = 0, 0
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        for root, _, files in os.walk(cache_dir):
+            for file in files:
+                n_entries += 1
+                nbytes += os.path.getsize(os.path.join(root, file))
+    return {"n_entries": n_entries, "nbytes": nbytes}
+
+
+# Cache events are recorded by JAX in the thread that compiles, so they are collected per thread
+_thread_events = threading.local()
+_listener_lock = threading.Lock()
+_listener_registered = False
+
+
+def _on_jax_event(event: str, **kwargs):
+    events = getattr(_thread_events, "events", None)
+    if events is not None and event in (EVENT_CACHE_HIT, EVENT_CACHE_MISS):
+        events.append(event)
+
+
+def _register_listener():
+    global _listener_registered
+    with _listener_lock:
+        if not _listener_registered:
+            jax.monitoring.register_event_listener(_on_jax_event)
+            _listener_registered = True
+
+
+_threshold_lock = threading.RLock()
+
+
+@contextmanager
+def _min_compile_time_secs(min_compile_time_secs: Optional[float]):
+    """Temporarily set the compile time threshold of the persistent compilation cache (None to keep it)."""
+    if min_compile_time_secs is None:
+        yield
+        return
+    with _threshold_lock:
+        min_compile_time_secs_old = (
+            jax.config.jax_persistent_cache_min_compile_time_secs
+        )
+        jax.config.update(
+            "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs
+        )
+        try:
+            yield
+        finally:
+            jax.config.update(
+                "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs_old
+            )
+
+
+def to_shape_dtype_struct(tree: Any) -> Any:
+    """Replace the array-like leaves (anything with a shape and a dtype) of a pytree by jax.ShapeDtypeStruct.
+    Other leaves are kept as is."""
+
+    def convert(leaf):
+        if hasattr(leaf, "shape") and hasattr(leaf, "dtype"):
+            return jax.ShapeDtypeStruct(leaf.shape, leaf.dtype)
+        return leaf
+
+    return jax.tree_util.tree_map(convert, tree)
+
+
+class CompilationWarmup:
+    """Register jitted functions with example inputs and compile them ahead of time at startup.
+    Combined with the persistent compilation cache, restarts load the executables from disk instead of recompiling them.
+
+    warmup = CompilationWarmup()  # configures the persistent compilation cache
+    train_step_compiled = warmup.register(train_step, params, jax.ShapeDtypeStruct((64, 784), jnp.float32))
+    warmup.register(eval_step, params, jax.ShapeDtypeStruct((256, 784), jnp.float32))
+    report = warmup.warmup(parallel=True)
+    # {"functions": {"train_step": {"compile_time": 0.05, "cache_hit": True, ...}, ...}, "n_cache_hits": 2, "cache_nbytes": ...}
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        setup_cache: bool = True,
+        min_compile_time_secs: float = 0.0,
+    ):
+        """Initialize the CompilationWarmup.
+
+        Args:
+            cache_dir (str, optional): the directory of the persistent compilation cache. Defaults to None (see setup_compilation_cache).
+            setup_cache (bool, optional): whether to configure the persistent compilation cache. Defaults to True.
+            min_compile_time_secs (float, optional): only cache the registered executables that took at least this time to compile.
+                The threshold is only changed while the registered functions are compiled, other compilations of the process keep the threshold of JAX.
+                Defaults to 0.0 (cache every registered function). None keeps the threshold of JAX.
+        """
+        self.min_compile_time_secs = min_compile_time_secs
+        if setup_cache:
+            self.cache_dir = setup_compilation_cache(cache_dir)
+        else:
+            self.cache_dir = cache_dir or jax.config.jax_compilation_cache_dir
+        self.name_to_registered: Dict[str, Dict[str, Any]] = {}
+        self.name_to_compiled: Dict[str, Any] = {}
+        self.name_to_stats: Dict[str, Dict[str, Any]] = {}
+        _register_listener()
+
+    def register(
+        self,
+        func: Callable,
+        *example_args: Any,
+        name: str = None,
+        jit_kwargs: Dict[str, Any] = None,
+        **example_kwargs: Any,
+    ) -> Callable:
+        """Register a function to compile with example inputs.
+        Array-like example inputs are only used for their shape and dtype, so jax.ShapeDtypeStruct can be used to avoid allocating them.
+
+        Args:
+            func (Callable): the function to compile. It is jitted with jit_kwargs, unless it is already jitted.
+            *example_args (Any): the example positional inputs.
+            name (str, optional): the name of the registered function. Defaults to None (func.__name__, suffixed if already registered).
+            jit_kwargs (Dict[str, Any], optional): the keyword arguments of jax.jit (static_argnums, donate_argnums, ...). Defaults to None.
+            **example_kwargs (Any): the example keyword inputs.
+
+        Returns:
+            Callable: the jitted function.
+        """
+        if name is None:
+            name = getattr(func, "__name__", "function")
+            if name in self.name_to_registered:
+                k = 1
+                while f"{name}_{k}" in self.name_to_registered:
+                    k += 1
+                name = f"{name}_{k}"
+        assert name not in self.name_to_registered, f"{name} is already registered"
+        func_jitted = (
+            func if hasattr(func, "lower") else jax.jit(func, **(jit_kwargs or {}))
+        )
+        self.name_to_registered[name] = {
+            "func": func_jitted,
+            "args": to_shape_dtype_struct(example_args),
+            "kwargs": to_shape_dtype_struct(example_kwargs),
+        }
+        return func_jitted
+
+    def _compile(self, name: str) -> Dict[str, Any]:
+        """Lower and compile one registered function, and return its statistics."""
+        registered = self.name_to_registered[name]
+        _thread_events.events = []
+        try:
+            time_start = time.perf_counter()
+            lowered = registered["func"].lower(
+                *registered["args"], **registered["kwargs"]
+            )
+            time_lowered = time.perf_counter()
+            self.name_to_compiled[name] = lowered.compile()
+            time_compiled = time.perf_counter()
+            events = _thread_events.events
+        finally:
+            _thread_events.events = None
+        stats = {
+            "lowering_time": time_lowered - time_start,
+            "compile_time": time_compiled - time_lowered,
+            "cache_hit": EVENT_CACHE_HIT in events,
+        }
+        self.name_to_stats[name] = stats
+        return stats
+
+    def warmup(
+        self,
+        names: List[str] = None,
+        parallel: bool = False,
+        max_workers: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Lower and compile the registered functions ahead of time.
+
+        Args:
+            names (List[str], optional): the names of the functions to compile. Defaults to None (all registered functions not yet compiled).
+            parallel (bool, optional): whether to compile the functions in parallel threads (XLA compilation releases the GIL). Defaults to False.
+            max_workers (Optional[int], optional): the maximum number of threads if parallel. Defaults to None (ThreadPoolExecutor default).
+
+        Returns:
+            Dict[str, Any]: the report of the warmup (see get_report).
+        """
+        if names is None:
+            names = [
+                name
+                for name in self.name_to_registered
+                if name not in self.name_to_compiled
+            ]
+        time_start = time.perf_counter()
+        with _min_compile_time_secs(self.min_compile_time_secs):
+            if parallel and len(names) > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    list(executor.map(self._compile, names))
+            else:
+                for name in names:
+                    self._compile(name)
+        report = self.get_report()
+        report["warmup_time"] = time.perf_counter() - time_start
+        return report
+
+    def get_compiled(self, name: str) -> Any:
+        """Return the compiled executable of a registered function, compiling it if needed.
+
+        Args:
+            name (str): the name of the registered function.
+
+        Returns:
+            Any: the compiled executable, callable on inputs of the registered shapes and dtypes.
+        """
+        if name not in self.name_to_compiled:
+            with _min_compile_time_secs(self.min_compile_time_secs):
+                self._compile(name)
+        return self.name_to_compiled[name]
+
+    def get_report(self) -> Dict[str, Any]:
+        """Return the compilation statistics of the compiled functions and the size on disk of the cache.
+
+        Returns:
+            Dict[str, Any]: a dictionnary with the per-function statistics "functions" (lowering_time, compile_time, cache_hit),
+            "n_compiled", "n_cache_hits", "total_compile_time", "cache_dir", "cache_n_entries" and "cache_nbytes".
+        """
+        cache_size = get_cache_size(self.cache_dir)
+        return {
+            "functions": {
+                name: dict(stats) for name, stats in self.name_to_stats.items()
+            },
+            "n_compiled": len(self.name_to_stats),
+            "n_cache_hits": sum(
+                stats["cache_hit"] for stats in self.name_to_stats.values()
+            ),
+            "total_compile_time": sum(
+                stats["lowering_time"] + stats["compile_time"]
+                for stats in self.name_to_stats.values()
+            ),
+            "cache_dir": self.cache_dir,
+            "cache_n_entries": cache_size["n_entries"],
+            "cache_nbytes": cache_size["nbytes"],
+        }
@@ -1,7 +1,10 @@
 import os
-from typing import Dict, Type, Any, Tuple, Union
+from typing import Callable, Dict, List, Type, Any, Tuple, Union
+import multiprocessing
+import pickle
 import random
 import sys
+import threading
 
 from tbutils.exec_max_n import print_once
 from tbutils.config import try_get
@@ -41,14 +44,60 @@ def try_get_seed(
     return seed
 
 
+SEED_PROFILES = ("off", "fast", "strict")
 
-def set_seed(seed: int):
-    """Set the seed for reproducibility.
+
+def _set_switch(
+    changes: Dict[str, Tuple[Any, Any]],
+    name: str,
+    get_value: Callable[[], Any],
+    set_value: Callable[[Any], None],
+    value: Any,
+):
+    """Set a switch to value and record it in changes as (old value, new value) if it changed."""
+    value_old = get_value()
+    if value_old != value:
+        set_value(value)
+        changes[name] = (value_old, value)
+
+
+def _set_env_switch(changes: Dict[str, Tuple[Any, Any]], name: str, value: str):
+    """Set an environment variable and record it in changes if it changed."""
+    _set_switch(
+        changes,
+        name,
+        lambda: os.environ.get(name),
+        lambda v: os.environ.__setitem__(name, v),
+        value,
+    )
+
+
+def set_seed(
+    seed: int, profile: str = "fast", verbose: bool = False
+) -> Dict[str, Tuple[Any, Any]]:
+    """Set the seed for reproducibility, and the determinism switches of the given reproducibility profile.
     This function will set the seed for Python, Numpy, PyTorch and TensorFlow, but only if the corresponding library is already imported.
 
+    Profiles trade speed for reproducibility :
+        - "off" : seed only, and let libraries pick the fastest kernels (cuDNN enabled with its auto-tuner, non-deterministic algorithms allowed).
+        - "fast" : seed, and deterministic where it is free : cuDNN enabled, but its auto-tuner (which picks algorithms by timing) disabled.
+        - "strict" : bitwise reproducible runs, at a performance cost : deterministic algorithms only in PyTorch (with CUBLAS_WORKSPACE_CONFIG),
+            deterministic cuDNN, no TF32, op determinism in TensorFlow and deterministic ops in XLA (XLA_FLAGS only applies if set before JAX initializes).
+
     Args:
         seed (int): the seed to set
+        profile (str, optional): the reproducibility profile, one of "off", "fast" or "strict". Defaults to "fast".
+        verbose (bool, optional): whether to print the performance-relevant switches that were changed. Defaults to False.
+
+    Returns:
+        Dict[str, Tuple[Any, Any]]: the performance-relevant switches that were changed, mapped to their (old value, new value).
     """
+    assert (
+        profile in SEED_PROFILES
+    ), f"Unknown profile {profile}, should be one of {SEED_PROFILES}"
+    strict = profile == "strict"
+    changes = {}
+
     # Python
     random.seed(seed)
     os.environ["PYTHONHASHSEED"] = str(seed)
@@ -57,7 +106,7 @@ def set_seed(seed: int):
     if "numpy" in sys.modules:
         import numpy as np
 
-        np.random.seed(0)
+        np.random.seed(seed)
 
     # PyTorch
     if "torch" in sys.modules:
@@ -66,20 +115,356 @@ def set_seed(seed: int):
         torch.manual_seed(seed)
         torch.cuda.manual_seed(seed)
         torch.cuda.manual_seed_all(seed)
+        cudnn = torch.backends.cudnn
 
-        # This flag only allows cudnn algorithms that are determinestic unlike .benchmark
-        torch.backends.cudnn.deterministic = True
-
-        # this flag enables cudnn for some operations such as conv layers and RNNs,
-        # which can yield a significant speedup.
-        torch.backends.cudnn.enabled = False
+        def set_attr(obj, attr):
+            return lambda value: setattr(obj, attr, value)
 
-        # This flag enables the cudnn auto-tuner that finds the best algorithm to use
-        # for a particular configuration. (this mode is good whenever input sizes do not vary)
-        torch.backends.cudnn.benchmark = False
+        # cuDNN provides a significant speedup for some operations such as conv layers and RNNs, and has deterministic algorithms
+        _set_switch(
+            changes,
+            "torch.backends.cudnn.enabled",
+            lambda: cudnn.enabled,
+            set_attr(cudnn, "enabled"),
+            True,
+        )
+        # The cuDNN auto-tuner finds the best algorithm for each input configuration, but the choice depends on timings
+        _set_switch(
+            changes,
+            "torch.backends.cudnn.benchmark",
+            lambda: cudnn.benchmark,
+            set_attr(cudnn, "benchmark"),
+            profile == "off",
+        )
+        # Only allow cuDNN algorithms that are deterministic, which may be slower
+        _set_switch(
+            changes,
+            "torch.backends.cudnn.deterministic",
+            lambda: cudnn.deterministic,
+            set_attr(cudnn, "deterministic"),
+            strict,
+        )
+        _set_switch(
+            changes,
+            "torch.use_deterministic_algorithms",
+            torch.are_deterministic_algorithms_enabled,
+            torch.use_deterministic_algorithms,
+            strict,
+        )
+        if strict:
+            # TF32 matmuls/convolutions are faster but less precise, and results vary across GPU architectures
+            matmul = torch.backends.cuda.matmul
+            _set_switch(
+                changes,
+                "torch.backends.cuda.matmul.allow_tf32",
+                lambda: matmul.allow_tf32,
+                set_attr(matmul, "allow_tf32"),
+                False,
+            )
+            _set_switch(
+                changes,
+                "torch.backends.cudnn.allow_tf32",
+                lambda: cudnn.allow_tf32,
+                set_attr(cudnn, "allow_tf32"),
+                False,
+            )
+            # Required by cuBLAS for deterministic results when torch.use_deterministic_algorithms is enabled
+            _set_env_switch(changes, "CUBLAS_WORKSPACE_CONFIG", ":4096:8")
 
     # TensorFlow
     if "tensorflow" in sys.modules:
         import tensorflow as tf
 
         tf.random.set_seed(seed)
+        if strict:
+            tf.config.experimental.enable_op_determinism()
+            changes["tf.config.experimental.enable_op_determinism"] = (None, True)
+
+    # JAX (randomness is explicit through keys, only XLA kernels can be non-deterministic)
+    if strict:
+        xla_flags = os.environ.get("XLA_FLAGS", "")
+        if "--xla_gpu_deterministic_ops" not in xla_flags:
+            _set_env_switch(
+                changes,
+                "XLA_FLAGS",
+                f"{xla_flags} --xla_gpu_deterministic_ops=true".strip(),
+            )
+
+    if verbose:
+        print(f"[tbutils.seed] Seed {seed} set with profile '{profile}'")
+        for name, (value_old, value_new) in changes.items():
+            print(f"\t{name}: {value_old} -> {value_new}")
+    return changes
+
+
+def get_rng_state(
+    generators: Dict[str, Any] = None,
+    jax_keys: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """Capture the state of every RNG in use, to resume a run exactly where it stopped without replaying random draws.
+    Global RNGs (Python, Numpy, PyTorch CPU/CUDA, the global tf.random.Generator) are only captured if the corresponding library is already imported.
+
+    The snapshot only contains Python objects and numpy arrays, so it can be pickled next to a checkpoint (see save_rng_state)
+    and restored without importing the libraries that are not in use.
+
+    Args:
+        generators (Dict[str, Any], optional): named numpy Generators (or BitGenerators) to capture. Defaults to None.
+        jax_keys (Dict[str, Any], optional): named JAX keys to capture, either raw uint32 keys or typed keys. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: the snapshot of the RNG states.
+    """
+    state = {"python": random.getstate()}
+
+    # Numpy
+    if "numpy" in sys.modules:
+        import numpy as np
+
+        state["numpy"] = np.random.get_state()
+    if generators is not None:
+        state["numpy_generators"] = {
+            name: getattr(generator, "bit_generator", generator).state
+            for name, generator in generators.items()
+        }
+
+    # PyTorch
+    if "torch" in sys.modules:
+        import torch
+
+        state["torch"] = torch.get_rng_state().numpy()
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            state["torch_cuda"] = [
+                cuda_state.numpy() for cuda_state in torch.cuda.get_rng_state_all()
+            ]
+
+    # TensorFlow
+    if "tensorflow" in sys.modules:
+        import tensorflow as tf
+
+        state["tensorflow"] = tf.random.get_global_generator().state.numpy()
+
+    # JAX
+    if jax_keys is not None:
+        import jax
+        import numpy as np
+
+        state["jax_keys"] = {}
+        for name, key in jax_keys.items():
+            if jax.dtypes.issubdtype(key.dtype, jax.dtypes.prng_key):
+                state["jax_keys"][name] = {
+                    "impl": str(jax.random.key_impl(key)),
+                    "data": np.asarray(jax.random.key_data(key)),
+                }
+            else:
+                state["jax_keys"][name] = {"impl": None, "data": np.asarray(key)}
+    return state
+
+
+def set_rng_state(
+    state: Dict[str, Any],
+    generators: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """Restore the RNG states captured by get_rng_state, in O(1) whatever the number of random draws since the capture.
+
+    Args:
+        state (Dict[str, Any]): the snapshot of the RNG states, as returned by get_rng_state.
+        generators (Dict[str, Any], optional): the named numpy Generators (or BitGenerators) to restore in place. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: the restored JAX keys, by name (JAX keys are immutable values, so they have to be reassigned).
+    """
+    random.setstate(state["python"])
+
+    # Numpy
+    if "numpy" in state:
+        import numpy as np
+
+        np.random.set_state(state["numpy"])
+    if generators is not None:
+        for name, generator in generators.items():
+            getattr(generator, "bit_generator", generator).state = state[
+                "numpy_generators"
+            ][name]
+
+    # PyTorch
+    if "torch" in state:
+        import torch
+
+        torch.set_rng_state(torch.from_numpy(state["torch"]))
+        if "torch_cuda" in state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(
+                [torch.from_numpy(cuda_state) for cuda_state in state["torch_cuda"]]
+            )
+
+    # TensorFlow
+    if "tensorflow" in state:
+        import tensorflow as tf
+
+        tf.random.get_global_generator().reset(state["tensorflow"])
+
+    # JAX
+    jax_keys = {}
+    if "jax_keys" in state:
+        import jax
+        import jax.numpy as jnp
+
+        for name, key_state in state["jax_keys"].items():
+            if key_state["impl"] is not None:
+                jax_keys[name] = jax.random.wrap_key_data(
+                    key_state["data"], impl=key_state["impl"]
+                )
+            else:
+                jax_keys[name] = jnp.asarray(key_state["data"])
+    return jax_keys
+
+
+def save_rng_state(path: str, state: Dict[str, Any]):
+    """Save a snapshot of the RNG states (from get_rng_state) to a file, e.g. next to a checkpoint."""
+    with open(path, "wb") as f:
+        pickle.dump(state, f)
+
+
+def load_rng_state(path: str) -> Dict[str, Any]:
+    """Load a snapshot of the RNG states saved with save_rng_state. It can then be restored with set_rng_state."""
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _get_seed_sequence(root_seed: int, spawn_key: Union[int, Tuple[int, ...]]):
+    """Return the child SeedSequence of root_seed at spawn_key, in O(1).
+    SeedSequence(root_seed).spawn(n)[i] is the same as _get_seed_sequence(root_seed, i)."""
+    import numpy as np
+
+    if isinstance(spawn_key, int):
+        spawn_key = (spawn_key,)
+    return np.random.SeedSequence(root_seed, spawn_key=tuple(spawn_key))
+
+
+def spawn_seeds(root_seed: int, n_workers: int) -> List[int]:
+    """Spawn statistically independent integer seeds for n_workers workers from one root seed, in O(n_workers).
+    Unlike random seeds in a small range or seed + worker_id, the derived streams don't collide nor correlate.
+
+    Args:
+        root_seed (int): the root seed of the run.
+        n_workers (int): the number of workers.
+
+    Returns:
+        List[int]: the 32-bit seed of each worker.
+    """
+    import numpy as np
+
+    return [
+        int(seed_sequence.generate_state(1, np.uint32)[0])
+        for seed_sequence in np.random.SeedSequence(root_seed).spawn(n_workers)
+    ]
+
+
+def spawn_generators(root_seed: int, n_workers: int) -> List[Any]:
+    """Spawn statistically independent numpy Generators for n_workers workers (or vectorized envs) from one root seed.
+
+    Args:
+        root_seed (int): the root seed of the run.
+        n_workers (int): the number of workers.
+
+    Returns:
+        List[np.random.Generator]: the Generator of each worker.
+    """
+    import numpy as np
+
+    return [
+        np.random.default_rng(seed_sequence)
+        for seed_sequence in np.random.SeedSequence(root_seed).spawn(n_workers)
+    ]
+
+
+# Per-thread state of the workers seeded with seed_worker
+_worker_local = threading.local()
+
+
+def seed_worker(
+    root_seed: int,
+    worker_id: Union[int, Tuple[int, ...]],
+    profile: str = "fast",
+    seed_globals: bool = True,
+) -> Any:
+    """Seed a worker with its own independent stream, derived from the root seed and the worker id.
+    The worker's numpy Generator and random.Random are stored per thread, see get_worker_generator and get_worker_random.
+
+    Args:
+        root_seed (int): the root seed of the run.
+        worker_id (Union[int, Tuple[int, ...]]): the id of the worker, or a tuple of ids for nested workers.
+        profile (str, optional): the reproducibility profile passed to set_seed. Defaults to "fast".
+        seed_globals (bool, optional): whether to also seed the global RNGs of every library with set_seed. This should be False for threads,
+            as global RNGs are shared by all the threads of a process. Defaults to True.
+
+    Returns:
+        np.random.Generator: the Generator of the worker.
+    """
+    import numpy as np
+
+    seed_sequence = _get_seed_sequence(root_seed, worker_id)
+    seed = int(seed_sequence.generate_state(1, np.uint32)[0])
+    if seed_globals:
+        set_seed(seed, profile=profile)
+    _worker_local.generator = np.random.default_rng(seed_sequence)
+    _worker_local.random = random.Random(seed)
+    return _worker_local.generator
+
+
+def get_worker_generator() -> Any:
+    """Return the numpy Generator of the current worker (see seed_worker), or a new unseeded Generator if the worker was not seeded."""
+    if not hasattr(_worker_local, "generator"):
+        import numpy as np
+
+        _worker_local.generator = np.random.default_rng()
+    return _worker_local.generator
+
+
+def get_worker_random() -> random.Random:
+    """Return the random.Random of the current worker (see seed_worker), or a new unseeded one if the worker was not seeded."""
+    if not hasattr(_worker_local, "random"):
+        _worker_local.random = random.Random()
+    return _worker_local.random
+
+
+class WorkerSeedInitializer:
+    """A picklable initializer for multiprocessing.Pool, concurrent.futures.ProcessPoolExecutor and ThreadPoolExecutor,
+    that seeds each worker with an independent stream derived from one root seed (see seed_worker).
+
+    Workers are numbered 0, 1, 2, ... in order of start by a counter shared between the workers of the initializer, so that
+    two pools built with initializers of same root seed get the same streams. Process workers also seed every library's global RNGs,
+    thread workers only get their own Generator and random.Random (global RNGs are shared by threads).
+    Use one initializer per pool, or call reset() before reusing it for a new pool.
+
+    with multiprocessing.Pool(8, initializer=WorkerSeedInitializer(root_seed=42)) as pool:
+        pool.map(task, inputs)  # in task, use get_worker_generator() instead of np.random
+    """
+
+    def __init__(self, root_seed: int, profile: str = "fast"):
+        """Initialize the WorkerSeedInitializer.
+
+        Args:
+            root_seed (int): the root seed of the run.
+            profile (str, optional): the reproducibility profile passed to set_seed in process workers. Defaults to "fast".
+        """
+        self.root_seed = root_seed
+        self.profile = profile
+        # Created in the spawn context, so it can be shared with pools of any start method
+        self.worker_counter = multiprocessing.get_context("spawn").Value("i", 0)
+
+    def reset(self):
+        """Restart the numbering of the workers at 0, to reuse the initializer for a new pool."""
+        with self.worker_counter.get_lock():
+            self.worker_counter.value = 0
+
+    def __call__(self):
+        with self.worker_counter.get_lock():
+            worker_id = self.worker_counter.value
+            self.worker_counter.value += 1
+        # Pools run the initializer of process workers in their main thread
+        seed_worker(
+            self.root_seed,
+            worker_id,
+            profile=self.profile,
+            seed_globals=threading.current_thread() is threading.main_thread(),
+        )
@@ -1,6 +1,11 @@
 import sys
-from typing import Any, Dict, Tuple, Union
+from typing import Any, Dict, List, Tuple, Union
 import importlib
+import json
+import mmap
+import types
+import os
+import struct
 import numpy as np
 
 
@@ -82,3 +87,453 @@ def get_shape(
         return (len(obj), *first_shape)
     
     return ()
+
+
+NBYTES_SCALAR_TYPES = (str, bytes, bytearray, int, float, complex, bool, type(None))
+NBYTES_IGNORED_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+
+def _is_memory_mapped(array: np.ndarray) -> bool:
+    """Return whether the data of an array is a memory-mapped file (np.memmap, or a view of an mmap)."""
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def _get_deep_nbytes(obj: Any, seen: set) -> int:
+    """Return the number of bytes used by obj and everything it references, skipping objects whose id is in seen.
+    The ids of the visited objects are added to seen, so that shared objects are only counted once across calls.
+    """
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, NBYTES_SCALAR_TYPES):
+            total += sys.getsizeof(obj)
+        elif isinstance(obj, np.ndarray):
+            # getsizeof includes the data only if the array owns it
+            total += sys.getsizeof(obj)
+            base = obj.base
+            if _is_memory_mapped(obj):
+                # A view of a memory-mapped file (e.g. from load_memmap) only accounts for its own bytes, not the whole mapping
+                total += obj.nbytes if base is not None else 0
+            elif isinstance(base, np.ndarray):
+                stack.append(base)
+            elif base is not None and id(base) not in seen:
+                # Data owned by a non-array buffer (bytes, mmap, ...)
+                seen.add(id(base))
+                total += obj.nbytes
+        elif isinstance(obj, dict):
+            total += sys.getsizeof(obj)
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(obj)
+            stack.extend(obj)
+        elif isinstance(obj, NBYTES_IGNORED_TYPES):
+            continue
+        elif hasattr(obj, "nbytes"):
+            # Arrays of other frameworks (torch, jax, ...) without importing them
+            total += sys.getsizeof(obj) + int(obj.nbytes)
+        else:
+            total += sys.getsizeof(obj)
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return total
+
+
+def get_nbytes(
+    obj: Any,
+    parent_key: str = "",
+    sep: str = ".",
+    max_depth: int = None,
+) -> Dict[str, int]:
+    """Returns the deep memory footprint of a nested structure, as a breakdown by flattened key (as in get_dict_flattened),
+    sorted by decreasing size.
+
+    Nested dicts are walked once : numpy arrays are counted with their data (a view counts its base array once,
+    except views of memory-mapped files, as returned by load_memmap, which only count their own bytes and not the whole mapped file),
+    arrays of other frameworks through their nbytes attribute, containers and objects through sys.getsizeof and their content.
+    An object shared by several keys is only counted once, for the first key where it is found.
+    The dicts of the nested structure themselves are not counted.
+
+    Args:
+        obj (Any): the nested structure.
+        parent_key (str, optional): the base key string, also used as key if obj is not a dict. Defaults to "".
+        sep (str, optional): separator to use between keys. Defaults to ".".
+        max_depth (int, optional): the depth beyond which nested dicts are counted as one key. Defaults to None (no limit).
+
+    Returns:
+        Dict[str, int]: the dictionnary mapping flattened keys to their number of bytes, sorted by decreasing size.
+    """
+    seen = set()
+    nbytes = {}
+    stack = [(parent_key, obj, 0)]
+    while stack:
+        key, value, depth = stack.pop()
+        if isinstance(value, dict) and (max_depth is None or depth < max_depth):
+            seen.add(id(value))
+            for k, v in reversed(value.items()):
+                stack.append((f"{key}{sep}{k}" if key else str(k), v, depth + 1))
+        else:
+            nbytes[key] = _get_deep_nbytes(value, seen)
+    return dict(sorted(nbytes.items(), key=lambda item: item[1], reverse=True))
+
+
+class NestedBuffer:
+    """A preallocated struct-of-arrays buffer for nested dict samples (e.g. transitions of a rollout).
+
+    The per-key shape and dtype are inferred from the first sample added, and one contiguous numpy array
+    of shape (capacity, *shape) is preallocated per flattened key. Samples are written in place, so no
+    per-sample Python object is kept and no final stacking is needed.
+
+    When the buffer is full, it either overwrites the oldest samples (ring buffer, if overwrite is True)
+    or doubles its capacity (amortised growth, up to max_capacity if specified).
+
+    buffer = NestedBuffer(capacity=1000)
+    for transition in rollout:
+        buffer.add({"obs": obs, "reward": reward, "info": {"done": done}})
+    batch = buffer.sample(batch_size=64)  # {"obs": array (64, ...), "reward": array (64,), "info": {"done": array (64,)}}
+    data = buffer.get_views()  # zero-copy nested views over the stored samples
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        overwrite: bool = False,
+        max_capacity: int = None,
+        sep: str = ".",
+    ):
+        """Initialize the NestedBuffer. Arrays are allocated when the first sample is added.
+
+        Args:
+            capacity (int, optional): the initial number of samples the buffer can hold. Defaults to 1024.
+            overwrite (bool, optional): whether to overwrite the oldest samples when full (ring buffer) instead of growing. Defaults to False.
+            max_capacity (int, optional): the maximum capacity when growing. If reached, an error is raised. Defaults to None (no limit).
+            sep (str, optional): the separator used to flatten the samples' keys. Defaults to ".".
+        """
+        assert capacity > 0, f"Capacity should be positive, got {capacity}"
+        self.capacity = capacity
+        self.overwrite = overwrite
+        self.max_capacity = max_capacity
+        self.sep = sep
+        self.arrays: Dict[str, np.ndarray] = None
+        self.size = 0  # number of valid samples
+        self.idx_next = 0  # index where the next sample will be written
+
+    def _allocate(self, sample_flattened: Dict[str, Any]):
+        """Allocate the arrays from the shapes and dtypes of a flattened sample."""
+        self.arrays = {}
+        for key, value in sample_flattened.items():
+            if isinstance(value, np.ndarray):
+                shape, dtype = value.shape, value.dtype
+            else:
+                shape, dtype = get_shape(value), np.asarray(value).dtype
+                assert isinstance(
+                    shape, tuple
+                ), f"Can't store value of key {key} with shape {shape} in a NestedBuffer"
+            self.arrays[key] = np.empty((self.capacity, *shape), dtype=dtype)
+
+    def _grow(self, min_capacity: int):
+        """Grow the arrays to at least min_capacity samples, by doubling the capacity."""
+        new_capacity = self.capacity
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        if self.max_capacity is not None:
+            if min_capacity > self.max_capacity:
+                raise ValueError(
+                    f"NestedBuffer is full (max_capacity={self.max_capacity}) and overwrite is False"
+                )
+            new_capacity = min(new_capacity, self.max_capacity)
+        for key, array in self.arrays.items():
+            new_array = np.empty((new_capacity, *array.shape[1:]), dtype=array.dtype)
+            new_array[: self.size] = array[: self.size]
+            self.arrays[key] = new_array
+        self.capacity = new_capacity
+
+    def add(self, sample: Dict[str, Any]):
+        """Add one nested sample to the buffer.
+
+        Args:
+            sample (Dict[str, Any]): the nested dict sample, of same structure as the first sample added.
+        """
+        sample_flattened = get_dict_flattened(sample, sep=self.sep)
+        if self.arrays is None:
+            self._allocate(sample_flattened)
+        if self.idx_next == self.capacity:
+            if self.overwrite:
+                self.idx_next = 0
+            else:
+                self._grow(self.capacity + 1)
+        for key, array in self.arrays.items():
+            array[self.idx_next] = sample_flattened[key]
+        self.idx_next += 1
+        self.size = max(self.size, self.idx_next)
+
+    def add_batch(self, batch: Dict[str, Any]):
+        """Add a nested batch of samples, where each leaf has a leading batch dimension.
+
+        Args:
+            batch (Dict[str, Any]): the nested dict batch, whose leaves have shape (batch_size, *shape).
+        """
+        batch_flattened = {
+            key: np.asarray(value)
+            for key, value in get_dict_flattened(batch, sep=self.sep).items()
+        }
+        batch_size = len(next(iter(batch_flattened.values())))
+        if self.arrays is None:
+            self._allocate({key: value[0] for key, value in batch_flattened.items()})
+        if not self.overwrite and self.idx_next + batch_size > self.capacity:
+            self._grow(self.idx_next + batch_size)
+        if self.overwrite and batch_size > self.capacity:
+            # Only the last 'capacity' samples would remain
+            batch_flattened = {
+                key: value[-self.capacity :] for key, value in batch_flattened.items()
+            }
+            batch_size = self.capacity
+        n_first = min(batch_size, self.capacity - self.idx_next)
+        for key, array in self.arrays.items():
+            values = batch_flattened[key]
+            array[self.idx_next : self.idx_next + n_first] = values[:n_first]
+            array[: batch_size - n_first] = values[n_first:]
+        if n_first < batch_size:
+            self.idx_next = batch_size - n_first
+            self.size = self.capacity
+        else:
+            self.idx_next += batch_size
+            self.size = max(self.size, self.idx_next)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get_views(self, start: int = 0, stop: int = None) -> Dict[str, Any]:
+        """Return zero-copy nested views over the storage slots [start, stop) of the buffer.
+
+        Slots are storage positions : once a ring buffer has wrapped around, slot order is not insertion order.
+        Modifying the views modifies the buffer.
+
+        Args:
+            start (int, optional): the first slot. Defaults to 0.
+            stop (int, optional): the slot after the last one. Defaults to None (the number of samples in the buffer).
+
+        Returns:
+            Dict[str, Any]: the nested dict of views, with same structure as the samples.
+        """
+        if self.arrays is None:
+            return {}
+        stop = self.size if stop is None else min(stop, self.size)
+        return unflatten_dict(
+            {key: array[start:stop] for key, array in self.arrays.items()}, sep=self.sep
+        )
+
+    def get_ordered(self) -> Dict[str, Any]:
+        """Return the samples of the buffer from the oldest to the most recent.
+        This is a zero-copy view unless a ring buffer has wrapped around, in which case the arrays are copied.
+
+        Returns:
+            Dict[str, Any]: the nested dict of arrays, with same structure as the samples.
+        """
+        if self.size < self.capacity or self.idx_next == self.capacity:
+            return self.get_views()
+        return unflatten_dict(
+            {
+                key: np.concatenate([array[self.idx_next :], array[: self.idx_next]])
+                for key, array in self.arrays.items()
+            },
+            sep=self.sep,
+        )
+
+    def sample(
+        self, batch_size: int, rng: np.random.Generator = None, replace: bool = True
+    ) -> Dict[str, Any]:
+        """Return a random minibatch of samples from the buffer.
+
+        Args:
+            batch_size (int): the number of samples.
+            rng (np.random.Generator, optional): the random generator to use. Defaults to None (np.random.default_rng()).
+            replace (bool, optional): whether to sample with replacement. Defaults to True.
+
+        Returns:
+            Dict[str, Any]: the nested dict of arrays of shape (batch_size, *shape).
+        """
+        assert self.size > 0, "Can't sample from an empty NestedBuffer"
+        if rng is None:
+            rng = np.random.default_rng()
+        if replace:
+            indices = rng.integers(0, self.size, size=batch_size)
+        else:
+            indices = rng.choice(self.size, size=batch_size, replace=False)
+        return unflatten_dict(
+            {key: array[indices] for key, array in self.arrays.items()}, sep=self.sep
+        )
+
+    def clear(self):
+        """Empty the buffer without deallocating its arrays."""
+        self.size = 0
+        self.idx_next = 0
+
+
+MEMMAP_MAGIC = b"TBUMMAP1"
+MEMMAP_HEADER_SIZE = len(MEMMAP_MAGIC) + 8  # magic + uint64 offset of the index
+
+
+def _align(offset: int, alignment: int) -> int:
+    """Return the smallest multiple of alignment that is >= offset."""
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def get_memmap_index(path: str) -> Dict[str, Dict[str, Any]]:
+    """Read the index of a file written with save_memmap, without reading any array.
+
+    Args:
+        path (str): the path of the file.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: a dictionnary mapping each flattened key to its "dtype" (a numpy descr, see np.lib.format.dtype_to_descr), "shape" and "offset" in the file.
+    """
+    with open(path, "rb") as f:
+        header = f.read(MEMMAP_HEADER_SIZE)
+        assert (
+            header[: len(MEMMAP_MAGIC)] == MEMMAP_MAGIC
+        ), f"{path} is not a file written with tbutils.struct.save_memmap"
+        (index_offset,) = struct.unpack("<Q", header[len(MEMMAP_MAGIC) :])
+        f.seek(index_offset)
+        return json.loads(f.read().decode("utf-8"))
+
+
+def _write_arrays(
+    f, arrays_flattened: Dict[str, np.ndarray], start: int, alignment: int
+) -> Tuple[Dict[str, Dict[str, Any]], int]:
+    """Write the raw buffers of the arrays from position start, each aligned on alignment bytes.
+
+    Returns the index entries of the arrays and the position after the last buffer.
+    """
+    index = {}
+    position = start
+    for key, array in arrays_flattened.items():
+        assert (
+            not array.dtype.hasobject
+        ), f"Can't memory-map the array of key {key} with dtype {array.dtype}"
+        # The descr (as in .npy files) keeps the fields of structured dtypes, unlike dtype.str
+        descr = np.lib.format.dtype_to_descr(array.dtype)
+        assert (
+            np.lib.format.descr_to_dtype(json.loads(json.dumps(descr))) == array.dtype
+        ), f"Can't memory-map the array of key {key} with dtype {array.dtype}"
+        position = _align(position, alignment)
+        f.seek(position)
+        f.write(np.ascontiguousarray(array).tobytes())
+        index[key] = {
+            "dtype": descr,
+            "shape": list(array.shape),
+            "offset": position,
+        }
+        position += array.nbytes
+    return index, position
+
+
+def _write_index(f, index: Dict[str, Dict[str, Any]], position: int):
+    """Write the index at position, then point the header to it. The header is updated last,
+    so an interrupted write leaves the file with its previous (valid) index."""
+    f.seek(position)
+    f.write(json.dumps(index).encode("utf-8"))
+    f.truncate()
+    f.flush()
+    os.fsync(f.fileno())
+    f.seek(len(MEMMAP_MAGIC))
+    f.write(struct.pack("<Q", position))
+
+
+def save_memmap(path: str, d: Dict[str, Any], sep: str = ".", alignment: int = 64):
+    """Save a nested dictionary of arrays in a single file that can be memory-mapped with load_memmap.
+
+    The file is made of a small header, the raw buffers of the arrays (each aligned on alignment bytes),
+    and an index mapping each flattened key (as in get_dict_flattened) to its dtype, shape and offset.
+
+    Args:
+        path (str): the path of the file.
+        d (Dict[str, Any]): the nested dictionary of arrays (or array-like objects).
+        sep (str, optional): the separator used to flatten the keys. Defaults to ".".
+        alignment (int, optional): the alignment of each buffer in bytes. Defaults to 64.
+    """
+    arrays_flattened = {
+        key: np.asarray(value) for key, value in get_dict_flattened(d, sep=sep).items()
+    }
+    with open(path, "wb") as f:
+        f.write(MEMMAP_MAGIC + struct.pack("<Q", 0))
+        index, position = _write_arrays(
+            f, arrays_flattened, MEMMAP_HEADER_SIZE, alignment
+        )
+        _write_index(f, index, position)
+
+
+def append_memmap(path: str, d: Dict[str, Any], sep: str = ".", alignment: int = 64):
+    """Add new keys to a file written with save_memmap, without rewriting the existing buffers.
+    The new buffers and index are written after the previous index, so that an interrupted append leaves the file valid:
+    each append leaves the previous index as unused space in the file. Rewrite the file with save_memmap to reclaim it.
+
+    Args:
+        path (str): the path of the file.
+        d (Dict[str, Any]): the nested dictionary of new arrays. Its flattened keys must not already be in the file.
+        sep (str, optional): the separator used to flatten the keys. Defaults to ".".
+        alignment (int, optional): the alignment of each buffer in bytes. Defaults to 64.
+    """
+    index = get_memmap_index(path)
+    arrays_flattened = {
+        key: np.asarray(value) for key, value in get_dict_flattened(d, sep=sep).items()
+    }
+    keys_existing = [key for key in arrays_flattened if key in index]
+    if len(keys_existing) > 0:
+        raise KeyError(f"Keys {keys_existing} are already in {path}")
+    with open(path, "r+b") as f:
+        # New buffers are written after the current index, which stays valid until the header is updated
+        start = f.seek(0, os.SEEK_END)
+        new_index, position = _write_arrays(f, arrays_flattened, start, alignment)
+        index.update(new_index)
+        _write_index(f, index, position)
+
+
+def load_memmap(
+    path: str, keys: List[str] = None, mode: str = "r", sep: str = "."
+) -> Dict[str, Any]:
+    """Load a file written with save_memmap as a nested dictionary of np.memmap views.
+    Nothing is read from disk until the views are accessed, and only the accessed pages are read.
+
+    Args:
+        path (str): the path of the file.
+        keys (List[str], optional): the flattened keys (or prefixes of flattened keys) to load. Defaults to None (all keys).
+        mode (str, optional): the memmap mode, "r" (read-only), "r+" (read-write) or "c" (copy-on-write). Defaults to "r".
+        sep (str, optional): the separator used to unflatten the keys. Defaults to ".".
+
+    Returns:
+        Dict[str, Any]: the nested dictionary of np.memmap views.
+    """
+    index = get_memmap_index(path)
+    if keys is not None:
+        index = {
+            key: entry
+            for key, entry in index.items()
+            if any(key == k or key.startswith(k + sep) for k in keys)
+        }
+    # One mapping of the whole file, sliced into zero-copy views
+    buffer = np.memmap(path, dtype=np.uint8, mode=mode)
+    arrays_flattened = {}
+    for key, entry in index.items():
+        dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        offset = entry["offset"]
+        arrays_flattened[key] = (
+            buffer[offset : offset + nbytes].view(dtype).reshape(shape)
+        )
+    return unflatten_dict(arrays_flattened, sep=sep)
@@ -1,6 +1,11 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import cProfile
+import os
+import re
+import sys
+import threading
 import time
-from typing import Any, Callable, Dict, Union
+from typing import Any, Callable, Dict, List, Union
 
 
 def timeit(func: Callable[..., Any]) -> Callable[..., Union[Any, float]]:
@@ -18,6 +23,83 @@ def timeit(func: Callable[..., Any]) -> Callable[..., Union[Any, float]]:
 TOTAL_KEYWORD = "total"
 
 
+class StackSampler:
+    """A lightweight sampling profiler : a background thread records the Python stacks of the threads that are being sampled,
+    every interval seconds. It sleeps when no thread is being sampled, so it costs nothing outside of sampled sections.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """Initialize the StackSampler. Its thread is started on the first call to start_sampling.
+
+        Args:
+            interval (float, optional): the time between two samples, in seconds. Defaults to 0.005.
+        """
+        self.interval = interval
+        self.thread_id_to_samples: Dict[int, List[Counter]] = {}
+        self.lock = threading.Lock()
+        self.event_active = threading.Event()
+        self.thread = None
+
+    def start_sampling(self, thread_id: int = None) -> Counter:
+        """Start sampling the stacks of a thread (the current one by default).
+
+        Returns:
+            Counter: the counter of the sampled stacks (in folded format, from root to leaf), filled until stop_sampling is called.
+        """
+        thread_id = threading.get_ident() if thread_id is None else thread_id
+        samples = Counter()
+        with self.lock:
+            self.thread_id_to_samples.setdefault(thread_id, []).append(samples)
+            self.event_active.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return samples
+
+    def stop_sampling(self, samples: Counter, thread_id: int = None):
+        """Stop filling the counter of sampled stacks returned by start_sampling."""
+        thread_id = threading.get_ident() if thread_id is None else thread_id
+        with self.lock:
+            list_samples = self.thread_id_to_samples[thread_id]
+            list_samples.remove(samples)
+            if len(list_samples) == 0:
+                del self.thread_id_to_samples[thread_id]
+            if len(self.thread_id_to_samples) == 0:
+                self.event_active.clear()
+
+    @staticmethod
+    def _format_stack(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            )
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while True:
+            self.event_active.wait()
+            frames = sys._current_frames()
+            with self.lock:
+                items = [
+                    (thread_id, list(list_samples))
+                    for thread_id, list_samples in self.thread_id_to_samples.items()
+                ]
+            for thread_id, list_samples in items:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = self._format_stack(frame)
+                    for samples in list_samples:
+                        samples[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+stack_sampler = StackSampler()
+
+
 class RuntimeMeter:
     """A context manager class to measure the time of various stages of the code take.
 
@@ -38,6 +120,79 @@ class RuntimeMeter:
     stage_name_to_cum_runtime: Dict[str, float] = defaultdict(lambda: 0)
     stage_name_to_last_runtime: Dict[str, float] = defaultdict(lambda: None)
     stage_name_to_num_calls: Dict[str, int] = defaultdict(lambda: 0)
+    stage_name_to_slow_profiling: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def enable_slow_profiling(
+        stage_name: str,
+        threshold: float = None,
+        threshold_ratio: float = None,
+        dir_profiles: str = "slow_profiles",
+        profiler: str = "sampler",
+        max_dumps: int = 10,
+        min_interval: float = 60.0,
+        min_calls: int = 10,
+    ):
+        """Arm a profiler on every call of a stage, and save the profile of the calls that are slower than a threshold.
+        This captures the evidence of occasional outliers automatically, at near-zero cost on normal calls with the "sampler" profiler.
+
+        A call is slow if it takes more than threshold seconds, or more than threshold_ratio times the average runtime of the stage
+        (only once the stage has been called min_calls times). Dumps are rate-limited to one every min_interval seconds and max_dumps in total per stage.
+        Profiles are saved in dir_profiles, as folded stacks ("<stage>_<time>_<index>_<runtime>s.folded", viewable with flamegraph tools such as speedscope)
+        for the "sampler" profiler, or as pstats files ("<stage>_<time>_<index>_<runtime>s.prof") for the "cprofile" profiler.
+
+        Args:
+            stage_name (str): the name of the stage.
+            threshold (float, optional): the absolute runtime threshold, in seconds. Defaults to None.
+            threshold_ratio (float, optional): the threshold, as a multiple of the average runtime of the stage. Defaults to None.
+            dir_profiles (str, optional): the directory where profiles are saved. Defaults to "slow_profiles".
+            profiler (str, optional): "sampler" (a background stack sampler, near-zero overhead) or "cprofile" (deterministic, but slows down every call). Defaults to "sampler".
+            max_dumps (int, optional): the maximum number of profiles saved for the stage. Defaults to 10.
+            min_interval (float, optional): the minimum time between two saved profiles of the stage, in seconds. Defaults to 60.0.
+            min_calls (int, optional): the number of calls before threshold_ratio is used. Defaults to 10.
+        """
+        assert (
+            threshold is not None or threshold_ratio is not None
+        ), "At least one of threshold and threshold_ratio should be specified"
+        assert profiler in (
+            "sampler",
+            "cprofile",
+        ), f"Unknown profiler {profiler}, should be 'sampler' or 'cprofile'"
+        RuntimeMeter.stage_name_to_slow_profiling[stage_name] = {
+            "threshold": threshold,
+            "threshold_ratio": threshold_ratio,
+            "dir_profiles": dir_profiles,
+            "profiler": profiler,
+            "max_dumps": max_dumps,
+            "min_interval": min_interval,
+            "min_calls": min_calls,
+            "n_dumps": 0,
+            "time_last_dump": None,
+            "paths": [],
+        }
+
+    @staticmethod
+    def disable_slow_profiling(stage_name: str):
+        """Disarm the profiler of a stage armed with enable_slow_profiling.
+
+        Args:
+            stage_name (str): the name of the stage.
+        """
+        RuntimeMeter.stage_name_to_slow_profiling.pop(stage_name, None)
+
+    @staticmethod
+    def get_slow_profiles(stage_name: str) -> List[str]:
+        """Return the paths of the profiles saved for the slow calls of a stage.
+
+        Args:
+            stage_name (str): the name of the stage.
+
+        Returns:
+            List[str]: the paths of the saved profiles.
+        """
+        if stage_name not in RuntimeMeter.stage_name_to_slow_profiling:
+            return []
+        return list(RuntimeMeter.stage_name_to_slow_profiling[stage_name]["paths"])
 
     @staticmethod
     def get_stage_runtime(stage_name: str) -> float:
@@ -141,13 +296,90 @@ class RuntimeMeter:
         self.n_calls = n_calls
 
     def __enter__(self):
+        self.profile = None
+        self.profile_config = self.stage_name_to_slow_profiling.get(self.stage_name)
+        if self.profile_config is not None:
+            self._start_profiling()
         self.start_time = time.time()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.stage_name_to_cum_runtime[self.stage_name] += time.time() - self.start_time
-        self.stage_name_to_last_runtime[self.stage_name] = time.time() - self.start_time
+        runtime = time.time() - self.start_time
+        # Compared to the average of the previous calls, before recording this one
+        is_slow = self.profile is not None and self._is_slow(runtime)
+        self.stage_name_to_cum_runtime[self.stage_name] += runtime
+        self.stage_name_to_last_runtime[self.stage_name] = runtime
         self.stage_name_to_num_calls[self.stage_name] += self.n_calls
+        # The profiler teardown and the dump are not counted in the runtime of the stage
+        if self.profile is not None:
+            self._stop_profiling(runtime, is_slow)
+
+    def _start_profiling(self):
+        if self.profile_config["n_dumps"] >= self.profile_config["max_dumps"]:
+            return
+        if self.profile_config["profiler"] == "sampler":
+            self.profile = stack_sampler.start_sampling()
+        else:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is already active
+                return
+            self.profile = profile
+
+    def _stop_profiling(self, runtime: float, is_slow: bool):
+        if self.profile is None:
+            return
+        if self.profile_config["profiler"] == "sampler":
+            stack_sampler.stop_sampling(self.profile)
+        else:
+            self.profile.disable()
+        if is_slow:
+            self._dump_profile(runtime)
+        self.profile = None
+
+    def _is_slow(self, runtime: float) -> bool:
+        config = self.profile_config
+        if config["threshold"] is not None and runtime > config["threshold"]:
+            return True
+        n_calls = self.stage_name_to_num_calls[self.stage_name]
+        return (
+            config["threshold_ratio"] is not None
+            and n_calls >= config["min_calls"]
+            and runtime
+            > config["threshold_ratio"]
+            * self.n_calls
+            * self.stage_name_to_cum_runtime[self.stage_name]
+            / n_calls
+        )
+
+    def _dump_profile(self, runtime: float):
+        config = self.profile_config
+        time_now = time.time()
+        if config["n_dumps"] >= config["max_dumps"] or (
+            config["time_last_dump"] is not None
+            and time_now - config["time_last_dump"] < config["min_interval"]
+        ):
+            return
+        config["n_dumps"] += 1
+        config["time_last_dump"] = time_now
+        os.makedirs(config["dir_profiles"], exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", self.stage_name)
+        date = time.strftime("%Y%m%d-%H%M%S", time.localtime(time_now))
+        date += f".{int(time_now * 1000) % 1000:03d}"
+        # The dump index keeps names unique when several dumps happen in the same millisecond
+        path = os.path.join(
+            config["dir_profiles"], f"{name}_{date}_{config['n_dumps']}_{runtime:.3f}s"
+        )
+        if config["profiler"] == "sampler":
+            path += ".folded"
+            with open(path, "w") as f:
+                for stack, count in self.profile.most_common():
+                    f.write(f"{stack} {count}\n")
+        else:
+            path += ".prof"
+            self.profile.dump_stats(path)
+        config["paths"].append(path)
 
 
 def get_runtime_metrics():
@@ -0,0 +1,464 @@
+from collections import OrderedDict, defaultdict
+from functools import partial
+import threading
+from typing import Any, Callable, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+LEAF = "leaf"
+DICT = "dict"
+LIST = "list"
+TUPLE = "tuple"
+NAMEDTUPLE = "namedtuple"
+# Maximum number of compiled treedefs kept in memory (least recently used are evicted)
+MAX_COMPILED_TREEDEFS = 256
+# Deeper structures are not compiled, as the Python compiler fails on deeply nested expressions
+MAX_COMPILED_DEPTH = 100
+# Larger structures are not compiled, as compiling costs much more than a few recursive traversals
+MAX_COMPILED_LEAVES = 10000
+
+
+class TreeDef:
+    """The structure of a nested dict/list/tuple/namedtuple, without its leaves.
+    The types of dict keys are part of the structure (so {1: x} and {True: x} have different structures),
+    as well as the types of dict subclasses (OrderedDict, defaultdict with its default_factory, ...), which are preserved by unflattening.
+
+    A TreeDef is immutable and hashable, so it can be reused across calls (and used as a cache key):
+    passing a known treedef skips all the structural inspection of the tree, and compiles (once) flattening and unflattening functions specialized to that structure.
+
+    leaves, treedef = tree_flatten({"a": [1, 2], "b": 3})
+    leaves = tree_flatten({"a": [4, 5], "b": 6}, treedef=treedef)[0]  # no isinstance checks
+    tree = tree_unflatten(treedef, leaves)
+    """
+
+    __slots__ = (
+        "kind",
+        "node_data",
+        "children",
+        "dict_type",
+        "key_types",
+        "num_leaves",
+        "depth",
+        "_hash",
+    )
+
+    def __init__(
+        self,
+        kind: str,
+        node_data: Hashable = None,
+        children: Tuple["TreeDef", ...] = (),
+        dict_type: Hashable = None,
+    ):
+        """Initialize the TreeDef.
+
+        Args:
+            kind (str): the kind of node, one of "leaf", "dict", "list", "tuple" or "namedtuple".
+            node_data (Hashable, optional): the keys of a dict node or the class of a namedtuple node. Defaults to None.
+            children (Tuple[TreeDef, ...], optional): the treedefs of the children of the node. Defaults to ().
+            dict_type (Hashable, optional): for a dict node, None for a dict, the class of a dict subclass, or (class, default_factory) for a defaultdict. Defaults to None.
+        """
+        self.kind = kind
+        self.node_data = node_data
+        self.children = children
+        self.dict_type = dict_type
+        # Keys such as 1 and True are equal, but rebuilding a tree with the keys of the other would change it
+        self.key_types = tuple(type(key) for key in node_data) if kind == DICT else None
+        self.num_leaves = (
+            1 if kind == LEAF else sum(child.num_leaves for child in children)
+        )
+        self.depth = 1 + max((child.depth for child in children), default=-1)
+        self._hash = hash((kind, node_data, children, dict_type, self.key_types))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: Any) -> bool:
+        if self is other:
+            return True
+        return (
+            isinstance(other, TreeDef)
+            and self._hash == other._hash
+            and self.kind == other.kind
+            and self.node_data == other.node_data
+            and self.key_types == other.key_types
+            and self.dict_type == other.dict_type
+            and self.children == other.children
+        )
+
+    def __repr__(self) -> str:
+        if self.kind == LEAF:
+            return "*"
+        if self.kind == DICT:
+            items = ", ".join(
+                f"{key!r}: {child!r}"
+                for key, child in zip(self.node_data, self.children)
+            )
+            if self.dict_type is None:
+                return f"{{{items}}}"
+            return f"{_get_dict_class(self.dict_type).__name__}({{{items}}})"
+        items = ", ".join(repr(child) for child in self.children)
+        if self.kind == LIST:
+            return f"[{items}]"
+        if self.kind == TUPLE:
+            return f"({items})"
+        return f"{self.node_data.__name__}({items})"
+
+
+LEAF_TREEDEF = TreeDef(LEAF)
+
+
+def _get_dict_type(tree: dict) -> Hashable:
+    """Return the dict_type of a dict node (see TreeDef)."""
+    if type(tree) is dict:
+        return None
+    if isinstance(tree, defaultdict):
+        return (type(tree), tree.default_factory)
+    return type(tree)
+
+
+def _get_dict_class(dict_type: Hashable) -> type:
+    if dict_type is None:
+        return dict
+    return dict_type[0] if isinstance(dict_type, tuple) else dict_type
+
+
+def _make_dict(dict_type: Hashable, d: dict) -> dict:
+    """Return the dict d converted to the dict_type of a dict node (see TreeDef)."""
+    if dict_type is None:
+        return d
+    if isinstance(dict_type, tuple):
+        return dict_type[0](dict_type[1], d)
+    return dict_type(d)
+
+
+def is_namedtuple(obj: Any) -> bool:
+    """Return whether the object is an instance of a namedtuple class."""
+    return isinstance(obj, tuple) and hasattr(type(obj), "_fields")
+
+
+def _flatten(
+    tree: Any, leaves: List[Any], is_leaf: Optional[Callable[[Any], bool]]
+) -> TreeDef:
+    """Append the leaves of the tree to 'leaves' and return the treedef of the tree."""
+    if is_leaf is not None and is_leaf(tree):
+        leaves.append(tree)
+        return LEAF_TREEDEF
+    if isinstance(tree, dict):
+        children = tuple(_flatten(value, leaves, is_leaf) for value in tree.values())
+        return TreeDef(DICT, tuple(tree.keys()), children, _get_dict_type(tree))
+    if isinstance(tree, list):
+        children = tuple(_flatten(value, leaves, is_leaf) for value in tree)
+        return TreeDef(LIST, None, children)
+    if isinstance(tree, tuple):
+        children = tuple(_flatten(value, leaves, is_leaf) for value in tree)
+        if is_namedtuple(tree):
+            return TreeDef(NAMEDTUPLE, type(tree), children)
+        return TreeDef(TUPLE, None, children)
+    leaves.append(tree)
+    return LEAF_TREEDEF
+
+
+def _check_num_children(treedef: TreeDef, tree: Any):
+    """Raise a ValueError if the node tree doesn't have as many children as the node treedef."""
+    if len(tree) != len(treedef.children):
+        expected = (
+            f"the keys {list(treedef.node_data)}"
+            if treedef.kind == DICT
+            else f"{len(treedef.children)} elements"
+        )
+        raise ValueError(
+            f"Expected a {treedef.kind} node with {expected}, got {len(tree)} children : {tree!r:.200}"
+        )
+
+
+def _flatten_up_to(treedef: TreeDef, tree: Any, leaves: List[Any]):
+    """Append the leaves of the tree to 'leaves', following the structure treedef.
+    Only the number of children of each node is checked, the types of the nodes are not inspected.
+    """
+    if treedef.kind == LEAF:
+        leaves.append(tree)
+        return
+    _check_num_children(treedef, tree)
+    if treedef.kind == DICT:
+        for key, child in zip(treedef.node_data, treedef.children):
+            _flatten_up_to(child, tree[key], leaves)
+    else:
+        for idx, child in enumerate(treedef.children):
+            _flatten_up_to(child, tree[idx], leaves)
+
+
+def _unflatten(treedef: TreeDef, leaves_iter: Iterator[Any]) -> Any:
+    """Rebuild the tree of structure treedef from an iterator over its leaves."""
+    if treedef.kind == LEAF:
+        return next(leaves_iter)
+    children = [_unflatten(child, leaves_iter) for child in treedef.children]
+    if treedef.kind == DICT:
+        return _make_dict(treedef.dict_type, dict(zip(treedef.node_data, children)))
+    if treedef.kind == LIST:
+        return children
+    if treedef.kind == TUPLE:
+        return tuple(children)
+    return treedef.node_data(*children)
+
+
+def _build_expressions(
+    treedef: TreeDef,
+    constants: List[Any],
+    counter: List[int],
+    path: str,
+    checks: List[Tuple[str, int]],
+) -> Tuple[List[str], str]:
+    """Build the Python expressions that flatten and unflatten a tree of structure treedef.
+
+    Returns a list of expressions accessing each leaf from the variable 'tree' (in flattening order),
+    and one expression rebuilding the tree from the list 'leaves'.
+    The path and number of children of each node are appended to 'checks', to check the structure of the flattened trees.
+    Dict keys and namedtuple classes are stored in 'constants' and referenced as 'C[i]', so any hashable key is supported.
+    """
+    if treedef.kind == LEAF:
+        idx_leaf = counter[0]
+        counter[0] += 1
+        return [path], f"leaves[{idx_leaf}]"
+    checks.append((path, len(treedef.children)))
+    if treedef.kind == DICT:
+        getters, builders = [], []
+        for key, child in zip(treedef.node_data, treedef.children):
+            constants.append(key)
+            key_expr = f"C[{len(constants) - 1}]"
+            child_getters, child_builder = _build_expressions(
+                child, constants, counter, f"{path}[{key_expr}]", checks
+            )
+            getters.extend(child_getters)
+            builders.append(f"{key_expr}: {child_builder}")
+        builder = "{" + ", ".join(builders) + "}"
+        if treedef.dict_type is not None:
+            constants.append(partial(_make_dict, treedef.dict_type))
+            builder = f"C[{len(constants) - 1}]({builder})"
+        return getters, builder
+    getters, builders = [], []
+    for idx, child in enumerate(treedef.children):
+        child_getters, child_builder = _build_expressions(
+            child, constants, counter, f"{path}[{idx}]", checks
+        )
+        getters.extend(child_getters)
+        builders.append(child_builder)
+    if treedef.kind == LIST:
+        return getters, "[" + ", ".join(builders) + "]"
+    if treedef.kind == TUPLE:
+        return getters, "(" + "".join(f"{b}, " for b in builders) + ")"
+    constants.append(treedef.node_data)
+    return getters, f"C[{len(constants) - 1}](" + ", ".join(builders) + ")"
+
+
+def _compile_treedef(
+    treedef: TreeDef,
+) -> Tuple[Callable[[Any], List[Any]], Callable[[Sequence[Any]], Any]]:
+    """Compile, once per treedef, a flattening and an unflattening function specialized to that structure.
+
+    The generated functions are single expressions with no loop and no type check (only the number of children of each node is checked,
+    so that trees with extra keys or elements raise instead of being silently truncated),
+    which makes flattening/unflattening a tree of known structure much faster than a recursive traversal.
+    """
+    constants, checks = [], []
+    getters, builder = _build_expressions(treedef, constants, [0], "tree", checks)
+    source = "def flatten(tree):\n"
+    if len(checks) > 0:
+        # On a mismatch, the recursive flattening finds the faulty node and raises a detailed error
+        source += (
+            f"    if ({''.join(f'len({path}), ' for path, _ in checks)}) != {tuple(n for _, n in checks)}:\n"
+            "        _flatten_up_to(T, tree, [])\n"
+        )
+    source += (
+        f"    return [{', '.join(getters)}]\n"
+        "def unflatten(leaves):\n"
+        f"    return {builder}\n"
+    )
+    namespace = {"C": constants, "T": treedef, "_flatten_up_to": _flatten_up_to}
+    exec(compile(source, f"<tbutils.tree {treedef!r}>", "exec"), namespace)
+    return namespace["flatten"], namespace["unflatten"]
+
+
+_treedef_to_compiled: "OrderedDict[TreeDef, Tuple[Callable, Callable]]" = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def _get_compiled(
+    treedef: TreeDef, compile: bool = True
+) -> Optional[Tuple[Callable[[Any], List[Any]], Callable[[Sequence[Any]], Any]]]:
+    """Return the compiled flattening and unflattening functions of a treedef, from a bounded LRU cache.
+
+    If the treedef is not in the cache, it is compiled only if compile is True and it is not too deep nor too large, else None is returned
+    and the caller should fall back to the recursive implementation.
+    """
+    with _compiled_lock:
+        compiled = _treedef_to_compiled.get(treedef)
+        if compiled is not None:
+            _treedef_to_compiled.move_to_end(treedef)
+            return compiled
+    if (
+        not compile
+        or treedef.depth > MAX_COMPILED_DEPTH
+        or treedef.num_leaves > MAX_COMPILED_LEAVES
+    ):
+        return None
+    compiled = _compile_treedef(treedef)
+    with _compiled_lock:
+        _treedef_to_compiled[treedef] = compiled
+        if len(_treedef_to_compiled) > MAX_COMPILED_TREEDEFS:
+            _treedef_to_compiled.popitem(last=False)
+    return compiled
+
+
+def _flatten_with_treedef(treedef: TreeDef, tree: Any, compile: bool) -> List[Any]:
+    """Flatten a tree of known structure, with the compiled function of the treedef if available (or compile is True)."""
+    compiled = _get_compiled(treedef, compile=compile)
+    if compiled is not None:
+        return compiled[0](tree)
+    leaves = []
+    _flatten_up_to(treedef, tree, leaves)
+    return leaves
+
+
+def _unflatten_with_treedef(
+    treedef: TreeDef, leaves: Sequence[Any], compile: bool
+) -> Any:
+    """Rebuild a tree of known structure, with the compiled function of the treedef if available (or compile is True)."""
+    assert (
+        len(leaves) == treedef.num_leaves
+    ), f"Expected {treedef.num_leaves} leaves for treedef {treedef}, got {len(leaves)}"
+    compiled = _get_compiled(treedef, compile=compile)
+    if compiled is not None:
+        return compiled[1](leaves)
+    return _unflatten(treedef, iter(leaves))
+
+
+def tree_flatten(
+    tree: Any,
+    treedef: Optional[TreeDef] = None,
+    is_leaf: Optional[Callable[[Any], bool]] = None,
+) -> Tuple[List[Any], TreeDef]:
+    """Flatten a nested structure of dicts, lists, tuples and namedtuples into a list of leaves and a treedef.
+    Any object that is not one of these containers (including None and arrays) is a leaf.
+
+    If treedef is given, the tree is assumed to have this structure and is flattened without any type inspection,
+    using a function compiled once per treedef (and kept in a bounded cache). This is the fast path for repeated calls on same-structured trees.
+    Only the number of children of each node is checked : a ValueError is raised if a node has extra (or missing) keys or elements.
+
+    Args:
+        tree (Any): the nested structure to flatten.
+        treedef (Optional[TreeDef], optional): the known structure of the tree. Defaults to None (the structure is inferred).
+        is_leaf (Optional[Callable[[Any], bool]], optional): a function returning True for sub-trees that should be considered leaves. Defaults to None.
+
+    Returns:
+        List[Any]: the leaves of the tree, in depth-first order (dict insertion order).
+        TreeDef: the structure of the tree.
+    """
+    if treedef is not None:
+        return _flatten_with_treedef(treedef, tree, compile=True), treedef
+    leaves = []
+    treedef = _flatten(tree, leaves, is_leaf)
+    return leaves, treedef
+
+
+def tree_unflatten(treedef: TreeDef, leaves: Sequence[Any]) -> Any:
+    """Rebuild a nested structure from its treedef and its leaves.
+    The compiled unflattening function of the treedef is used if it was compiled by a previous call with this treedef
+    (e.g. tree_flatten(tree, treedef=treedef)), else the structure is rebuilt recursively.
+
+    Args:
+        treedef (TreeDef): the structure of the tree, as returned by tree_flatten.
+        leaves (Sequence[Any]): the leaves of the tree, in the order returned by tree_flatten.
+
+    Returns:
+        Any: the nested structure.
+    """
+    return _unflatten_with_treedef(treedef, leaves, compile=False)
+
+
+def tree_structure(
+    tree: Any, is_leaf: Optional[Callable[[Any], bool]] = None
+) -> TreeDef:
+    """Return the treedef of a nested structure."""
+    return tree_flatten(tree, is_leaf=is_leaf)[1]
+
+
+def tree_leaves(
+    tree: Any, is_leaf: Optional[Callable[[Any], bool]] = None
+) -> List[Any]:
+    """Return the leaves of a nested structure."""
+    return tree_flatten(tree, is_leaf=is_leaf)[0]
+
+
+def tree_map(
+    func: Callable[[Any], Any],
+    tree: Any,
+    treedef: Optional[TreeDef] = None,
+    is_leaf: Optional[Callable[[Any], bool]] = None,
+    batched: bool = False,
+) -> Any:
+    """Apply a function to every leaf of a nested structure and return a new structure with the results.
+
+    Args:
+        func (Callable[[Any], Any]): the function to apply to each leaf. If batched is True, func is called once with the list of all leaves and must return the list of new leaves.
+        tree (Any): the nested structure.
+        treedef (Optional[TreeDef], optional): the known structure of the tree, to skip structural inspection and use compiled functions. Defaults to None.
+        is_leaf (Optional[Callable[[Any], bool]], optional): a function returning True for sub-trees that should be considered leaves. Defaults to None.
+        batched (bool, optional): whether to call func once on all leaves instead of once per leaf. Defaults to False.
+
+    Returns:
+        Any: the new nested structure, of same structure as tree.
+    """
+    compile = treedef is not None
+    leaves, treedef = tree_flatten(tree, treedef=treedef, is_leaf=is_leaf)
+    if batched:
+        new_leaves = func(leaves)
+    else:
+        new_leaves = [func(leaf) for leaf in leaves]
+    return _unflatten_with_treedef(treedef, new_leaves, compile=compile)
+
+
+def tree_map_multi(
+    func: Callable[..., Any],
+    tree: Any,
+    *rest: Any,
+    treedef: Optional[TreeDef] = None,
+    is_leaf: Optional[Callable[[Any], bool]] = None,
+    batched: bool = False,
+) -> Any:
+    """Apply a function to the corresponding leaves of several nested structures of same structure.
+    The structure is inferred from the first tree, and the other trees must have the same structure (same treedef).
+    If treedef is given, the trees are flattened without type inspection, only checking the number of children of each node.
+    A ValueError is raised if a tree doesn't have the structure of the first tree.
+
+    Args:
+        func (Callable[..., Any]): the function to apply, called as func(leaf, *rest_leaves). If batched is True, func is called once as func(leaves, *rest_leaves) on the lists of leaves and must return the list of new leaves.
+        tree (Any): the first nested structure.
+        *rest (Any): the other nested structures, of same structure as tree.
+        treedef (Optional[TreeDef], optional): the known structure of the trees, to skip structural inspection and use compiled functions. Defaults to None.
+        is_leaf (Optional[Callable[[Any], bool]], optional): a function returning True for sub-trees that should be considered leaves. Defaults to None.
+        batched (bool, optional): whether to call func once on all leaves instead of once per leaf. Defaults to False.
+
+    Returns:
+        Any: the new nested structure, of same structure as tree.
+    """
+    compile = treedef is not None
+    leaves, treedef = tree_flatten(tree, treedef=treedef, is_leaf=is_leaf)
+    rest_leaves = []
+    for other in rest:
+        if compile:
+            try:
+                rest_leaves.append(_flatten_with_treedef(treedef, other, compile=True))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise ValueError(
+                    f"All trees should have the structure {treedef}, but one of them does not: {e!r}"
+                ) from e
+        else:
+            other_leaves, other_treedef = tree_flatten(other, is_leaf=is_leaf)
+            if other_treedef != treedef:
+                raise ValueError(
+                    f"All trees should have the structure {treedef}, but one of them has the structure {other_treedef}"
+                )
+            rest_leaves.append(other_leaves)
+    if batched:
+        new_leaves = func(leaves, *rest_leaves)
+    else:
+        new_leaves = [func(*leaves_i) for leaves_i in zip(leaves, *rest_leaves)]
+    return _unflatten_with_treedef(treedef, new_leaves, compile=compile)